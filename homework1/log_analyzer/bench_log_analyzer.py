@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of log_analyzer:
+    python bench_log_analyzer.py generate --lines 10000000 --urls 100000 --errors 0.01 --gzip
+    python bench_log_analyzer.py stages --config log_analyzer.conf --profile stages.prof
+    python bench_log_analyzer.py parser --lines 10000000
+    python bench_log_analyzer.py process --urls 1000000
+    python bench_log_analyzer.py aggregation --lines 1000000
+"""
+
+import os
+import gzip
+import time
+import random
+import pstats
+import cProfile
+import argparse
+import resource
+import tempfile
+import log_analyzer as la
+
+LINE = ('{ip} -  - [29/Jun/2017:03:50:22 +0300] "GET {url} HTTP/1.1" 200 927 "-" "{agent}" "-" '
+        '"1498697422-2190034393-4708-9752759" "dc7161be3" {time:.3f}\n')
+
+AGENTS = [
+    "Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5",
+    "Python-urllib/2.7",
+    "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/59.0.3071.115 Safari/537.36"
+]
+
+
+# broken lines for error ratio: without request and without request_time
+BAD_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "-" 400 0 "-" "-" "-" "-" "-" 0.000\n',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/v2/banner/1 HTTP/1.1" 200 927 "-" "-" "-" "-" "-" -\n'
+]
+
+
+def gen_log(filename, lines, urls, errors=0.0, compress=None):
+    """Write synthetic ui_short log of lines lines with urls distinct urls and errors ratio of bad lines,
+    log is compressed if compress is True or filename ends with .gz"""
+    if compress is None:
+        compress = filename.endswith(".gz")
+    rnd = random.Random(lines)
+    log = gzip.open(filename, 'wt') if compress else open(filename, 'w')
+    with log:
+        for _ in range(lines):
+            if errors and rnd.random() < errors:
+                log.write(rnd.choice(BAD_LINES))
+                continue
+            log.write(LINE.format(ip="1.196.116.{}".format(rnd.randint(1, 254)),
+                                  url="/api/v2/banner/{}".format(rnd.randint(1, urls)),
+                                  agent=rnd.choice(AGENTS),
+                                  time=rnd.expovariate(5)))
+
+
+def bench_parser(filename, name):
+    """Read and parse log without aggregation, return lines/sec"""
+    parse = la.parse_line_bytes if name == "bytes" else la.parse_line
+    num_line = 0
+    start = time.perf_counter()
+    for line in la.gen_readlog(filename, binary=name == "bytes"):
+        parse(line)
+        num_line += 1
+    return num_line / (time.perf_counter() - start)
+
+
+def process_data_full_sort(data, cfg):
+    """Previous process_data: rows for every url and sort of all rows"""
+    count_digits = 3
+    total_count, total_time, urls = data
+    result = []
+    for url in urls:
+        count, url_sum, url_max, url_med, url_percentiles = la.get_url_stat(urls[url])
+        time_sum = round(url_sum, count_digits)
+        result.append({
+            "url": url,
+            "count": count,
+            "count_perc": round(100 * float(count) / total_count, count_digits),
+            "time_avg": round(url_sum / count, count_digits),
+            "time_max": round(url_max, count_digits),
+            "time_med": round(url_med, count_digits),
+            "time_perc": round(100 * time_sum / total_time, count_digits),
+            "time_sum": time_sum,
+        })
+        for q, value in zip(la.PERCENTILES, url_percentiles):
+            result[-1]["time_p{}".format(q)] = round(value, count_digits)
+    result.sort(key=lambda f: f['time_sum'], reverse=True)
+    return result[:cfg["REPORT_SIZE"]]
+
+
+def gen_data(urls, cfg):
+    """Make parsed data with urls distinct urls, 1-3 requests per url"""
+    rnd = random.Random(urls)
+    stat = la.LogStat(cfg)
+    for i in range(urls):
+        for _ in range(rnd.randint(1, 3)):
+            stat.add("/api/v2/banner/{}".format(i), round(rnd.expovariate(5), 3))
+    return stat.total_count, stat.total_time, stat.urls
+
+
+def bench_process(urls, cfg):
+    """Time process_data and full sort version, return (top_k_sec, full_sort_sec)"""
+    data = gen_data(urls, cfg)
+    start = time.perf_counter()
+    result = la.process_data(data, cfg)
+    top_k = time.perf_counter() - start
+    start = time.perf_counter()
+    expected = process_data_full_sort(data, cfg)
+    full_sort = time.perf_counter() - start
+    assert result == expected
+    return top_k, full_sort
+
+
+def bench_columns(urls, cfg):
+    """Time process_data of numpy backend and exact mode, return (numpy_sec, exact_sec)"""
+    data = gen_data(urls, dict(cfg, AGGREGATION="numpy"))
+    start = time.perf_counter()
+    result = la.process_data(data, cfg)
+    columns = time.perf_counter() - start
+    data = gen_data(urls, dict(cfg, AGGREGATION="exact"))
+    start = time.perf_counter()
+    expected = la.process_data(data, cfg)
+    exact = time.perf_counter() - start
+    assert result == expected
+    return columns, exact
+
+
+def bench_aggregation(filename, cfg):
+    """Time parse_log and process_data of numpy backend and exact mode, return (numpy_sec, exact_sec)"""
+    timings = []
+    results = []
+    for aggregation in ("numpy", "exact"):
+        cfg_aggregation = dict(cfg, AGGREGATION=aggregation)
+        start = time.perf_counter()
+        results.append(la.process_data(la.parse_log(filename, cfg_aggregation), cfg_aggregation))
+        timings.append(time.perf_counter() - start)
+    assert results[0] == results[1]
+    return tuple(timings)
+
+
+def peak_rss():
+    """Peak RSS in MB of this process and of finished worker processes"""
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return self_rss / 1024.0, children_rss / 1024.0
+
+
+def bench_stages(filename, cfg, profile=None):
+    """Time gen_readlog, parse_log, process_data and save_report separately, print stats"""
+    profiler = cProfile.Profile() if profile else None
+    timings = []
+
+    def stage(name, func, *args):
+        start = time.perf_counter()
+        if profiler:
+            profiler.enable()
+        result = func(*args)
+        if profiler:
+            profiler.disable()
+        timings.append((name, time.perf_counter() - start))
+        return result
+
+    binary = cfg["PARSER"] == "bytes"
+    num_line = stage("gen_readlog", lambda: sum(1 for _ in la.gen_readlog(filename, binary=binary)))
+    data = stage("parse_log", la.parse_log, filename, cfg)
+    if data is None:
+        print("Can't parse log {}".format(filename))
+        return
+    result = stage("process_data", la.process_data, data, cfg)
+    report = os.path.join(tempfile.gettempdir(), "report-bench." + cfg["REPORT_FORMAT"])
+    stage("save_report", la.save_report, report, result, cfg)
+    os.remove(report)
+
+    print("lines: {}, urls: {}, report rows: {}".format(num_line, len(data[2]), len(result)))
+    for name, sec in timings:
+        rate = " {:>12.0f} lines/sec".format(num_line / sec) if name in ("gen_readlog", "parse_log") else ""
+        print("{:<13} {:>8.3f} sec{}".format(name, sec, rate))
+    print("peak RSS: {:.1f} MB, workers {:.1f} MB".format(*peak_rss()))
+    if profiler:
+        profiler.dump_stats(profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(20)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bench", choices=("generate", "stages", "parser", "process", "aggregation"))
+    parser.add_argument("--lines", type=int, default=10000000)
+    parser.add_argument("--urls", type=int, default=100000)
+    parser.add_argument("--errors", type=float, default=0.0, help="ratio of bad lines in generated log")
+    parser.add_argument("--gzip", action="store_true", help="compress generated log")
+    parser.add_argument("--log", default=os.path.join(tempfile.gettempdir(), "nginx-access-ui.log-bench"))
+    parser.add_argument("--config", help="log_analyzer config for stages")
+    parser.add_argument("--profile", help="file for cProfile stats of stages")
+    args = parser.parse_args()
+
+    if args.bench == "generate":
+        filename = args.log + ".gz" if args.gzip and not args.log.endswith(".gz") else args.log
+        gen_log(filename, args.lines, args.urls, args.errors, args.gzip or None)
+        print("generated {}".format(filename))
+    elif args.bench == "stages":
+        if args.config:
+            la.config.update(la.read_config(args.config))
+        if not os.path.exists(args.log):
+            gen_log(args.log, args.lines, args.urls, args.errors)
+        bench_stages(args.log, la.config, args.profile)
+    elif args.bench == "parser":
+        if not os.path.exists(args.log):
+            gen_log(args.log, args.lines, args.urls)
+        for name in ("str", "bytes"):
+            rate = bench_parser(args.log, name)
+            print("{:<6} {:>12.0f} lines/sec".format(name, rate))
+    elif args.bench == "aggregation":
+        if la.np is None:
+            parser.error("numpy is required for aggregation benchmark")
+        if not os.path.exists(args.log):
+            gen_log(args.log, args.lines, args.urls)
+        columns, exact = bench_aggregation(args.log, la.config)
+        print("parse_log + process_data: numpy {:.2f} sec, exact {:.2f} sec".format(columns, exact))
+    else:
+        for aggregation in ("exact", "stream"):
+            top_k, full_sort = bench_process(args.urls, dict(la.config, AGGREGATION=aggregation))
+            print("{:<6} top-k {:.2f} sec, full sort {:.2f} sec".format(aggregation, top_k, full_sort))
+        if la.np is not None:
+            columns, exact = bench_columns(args.urls, la.config)
+            print("numpy  {:.2f} sec, exact {:.2f} sec".format(columns, exact))
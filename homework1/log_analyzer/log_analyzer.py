@@ -15,8 +15,25 @@ import logging
 import datetime
 import argparse
 import glob
-from collections import namedtuple
-from string import Template
+import math
+import zlib
+import queue
+import shutil
+import threading
+import subprocess
+import time
+import heapq
+import pickle
+import re
+import multiprocessing as mp
+from array import array
+from collections import namedtuple, deque
+from functools import partial
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 config = {
     "REPORT_SIZE": 1000,
@@ -25,14 +42,291 @@ config = {
     "TEMPLATE": "./reports/report.html",
     "LOG_FILE": "log_analyzer.log",
     "TS_FILE": "log_analyzer.ts",
-    "ERROR_TRESHOLD": 0.75
+    "ERROR_TRESHOLD": 0.75,
+    "AGGREGATION": "exact",
+    "SKETCH_ACCURACY": 0.01,
+    "WORKERS": 1,
+    "PARSER": "bytes",
+    "INCREMENTAL": False,
+    "URL_NORMALIZE": False,
+    "URL_MAX_KEYS": 0,
+    "REPORT_FORMAT": "html",
+    "FOLLOW_FILE": "./log/nginx-access-ui.log",
+    "FOLLOW_INTERVAL": 60
 }
 
 
-def get_last_log_file(cfg):
-    """Find last logfile"""
-    last_files = []
-    files_dt = namedtuple("files_dt", "fullname date")
+def str_to_bool(value):
+    """Convert config value to bool"""
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+# logfile name and its date as int YYYYMMDD
+files_dt = namedtuple("files_dt", "fullname date")
+
+# types of config values, other values are strings
+CONFIG_TYPES = {
+    "REPORT_SIZE": int,
+    "ERROR_TRESHOLD": float,
+    "SKETCH_ACCURACY": float,
+    "WORKERS": int,
+    "INCREMENTAL": str_to_bool,
+    "URL_NORMALIZE": str_to_bool,
+    "URL_MAX_KEYS": int,
+    "FOLLOW_INTERVAL": int
+}
+
+# path segments replaced by URL_NORMALIZE: numbers and hex ids with at least one digit
+NUMERIC_SEGMENT_RE = re.compile(r'(?<=/)\d+(?=/|$)')
+HEX_SEGMENT_RE = re.compile(r'(?<=/)(?=[a-f]*\d)[0-9a-f]{8,}(?=/|$)', re.IGNORECASE)
+
+# placeholder of report rows in TEMPLATE
+TABLE_JSON = "$table_json"
+
+# percentiles of request time in report rows, time_p90 etc.
+PERCENTILES = (90, 95, 99)
+
+# key of requests to urls over URL_MAX_KEYS distinct urls
+OTHER_URL = "other"
+
+# request times are summed as integer microseconds, so sums do not depend on order
+TIME_SCALE = 1000000
+
+# block size for searching the end of the last complete line
+STATE_BLOCK = 65536
+
+# lines per task for parser workers of compressed log, batches in flight per worker
+BATCH_SIZE = 100000
+BATCH_WINDOW = 2
+
+# gzip reader: block size, decompressed blocks queued by thread, gzip header and trailer for zlib,
+# external decompressor ("auto" - pigz if found, None - zlib in thread)
+GZIP_BLOCK = 1 << 20
+GZIP_QUEUE = 8
+GZIP_WBITS = zlib.MAX_WBITS | 16
+GZIP_TOOL = "auto"
+
+# follow mode: sliding windows in minutes, seconds between checks of log, default limit of urls
+FOLLOW_WINDOWS = (1, 5, 15)
+FOLLOW_BUCKET = 10
+FOLLOW_POLL = 1.0
+FOLLOW_MAX_KEYS = 10000
+
+
+class QuantileSketch(object):
+    """Mergeable quantile sketch with relative accuracy.
+
+    Values are counted in logarithmic buckets (gamma^(k-1), gamma^k], so any
+    quantile is estimated within `accuracy` relative error and memory depends
+    only on the range of values, not on their count.
+    """
+
+    __slots__ = ("accuracy", "gamma", "log_gamma", "zero_count", "count", "buckets")
+
+    def __init__(self, accuracy=0.01):
+        self.accuracy = accuracy
+        self.gamma = (1 + accuracy) / (1 - accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.zero_count = 0
+        self.count = 0
+        self.buckets = {}
+
+    def key(self, value):
+        """Bucket key of value, None for zero bucket"""
+        if value <= 0:
+            return None
+        return int(math.ceil(math.log(value) / self.log_gamma))
+
+    def add(self, value):
+        """Add value to sketch"""
+        self.count += 1
+        key = self.key(value)
+        if key is None:
+            self.zero_count += 1
+            return
+        self.buckets[key] = self.buckets.get(key, 0) + 1
+
+    def merge(self, other):
+        """Merge other sketch with the same accuracy into this one"""
+        self.count += other.count
+        self.zero_count += other.zero_count
+        for key, cnt in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + cnt
+
+    def value_at(self, rank):
+        """Estimate value with 0-based rank in sorted values"""
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Estimate q-quantile (nearest rank)"""
+        return self.value_at(max(int(math.ceil(q * self.count)) - 1, 0))
+
+    def median(self):
+        """Estimate median"""
+        if self.count % 2 == 0:
+            return (self.value_at(self.count // 2 - 1) + self.value_at(self.count // 2)) / 2.0
+        return self.value_at(self.count // 2)
+
+
+class UrlStat(object):
+    """Streaming aggregate of request times for one url"""
+
+    __slots__ = ("count", "usec_sum", "time_max", "sketch")
+
+    def __init__(self, accuracy=0.01):
+        self.count = 0
+        self.usec_sum = 0
+        self.time_max = 0
+        self.sketch = QuantileSketch(accuracy)
+
+    @property
+    def time_sum(self):
+        return self.usec_sum / TIME_SCALE
+
+    def add(self, acstime):
+        """Add request time"""
+        self.count += 1
+        self.usec_sum += int(round(acstime * TIME_SCALE))
+        if acstime > self.time_max:
+            self.time_max = acstime
+        self.sketch.add(acstime)
+
+    def merge(self, other):
+        """Merge other aggregate into this one"""
+        self.count += other.count
+        self.usec_sum += other.usec_sum
+        if other.time_max > self.time_max:
+            self.time_max = other.time_max
+        self.sketch.merge(other.sketch)
+
+
+class UrlColumns(object):
+    """Columns of (url id, request time) for numpy backend, ids are given in order of first request"""
+
+    __slots__ = ("index", "names", "ids", "times")
+
+    def __init__(self):
+        self.index = {}
+        self.names = []
+        self.ids = array('I')
+        self.times = array('d')
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def _url_id(self, url):
+        """Id of url, new url gets the next id"""
+        url_id = self.index.get(url)
+        if url_id is None:
+            url_id = self.index[url] = len(self.names)
+            self.names.append(url)
+        return url_id
+
+    def add(self, url, acstime):
+        """Add request time of url"""
+        self.ids.append(self._url_id(url))
+        self.times.append(acstime)
+
+    def merge(self, other, key=None):
+        """Append columns of the following part of log, key maps url of other to url in this columns"""
+        mapping = np.array([self._url_id(key(url) if key else url) for url in other.names], dtype=np.uint32)
+        if len(other.ids):
+            self.ids.frombytes(mapping[np.frombuffer(other.ids, dtype=np.uint32)].tobytes())
+        self.times.extend(other.times)
+
+
+def normalize_url(url):
+    """Strip query string, replace numeric and hex path segments with placeholders"""
+    path = url.split('?', 1)[0]
+    path = NUMERIC_SEGMENT_RE.sub(':id', path)
+    return HEX_SEGMENT_RE.sub(':hex', path)
+
+
+class LogStat(object):
+    """Aggregate of parsed log lines: line counters, totals and per-url stats"""
+
+    __slots__ = ("stream", "columns", "accuracy", "normalize", "max_keys",
+                 "num_line", "count_pass_line", "total_count", "total_usec", "urls")
+
+    def __init__(self, cfg):
+        if cfg["AGGREGATION"] == "numpy" and np is None:
+            raise RuntimeError("numpy is required for AGGREGATION: numpy")
+        self.stream = cfg["AGGREGATION"] == "stream"
+        self.columns = cfg["AGGREGATION"] == "numpy"
+        self.accuracy = cfg["SKETCH_ACCURACY"]
+        self.normalize = cfg["URL_NORMALIZE"]
+        self.max_keys = cfg["URL_MAX_KEYS"]
+        self.num_line = 0
+        self.count_pass_line = 0
+        self.total_count = 0
+        self.total_usec = 0
+        self.urls = UrlColumns() if self.columns else {}
+
+    @property
+    def total_time(self):
+        return self.total_usec / TIME_SCALE
+
+    def _key(self, url):
+        """Url key in urls, at most max_keys keys including OTHER_URL for the rest of urls"""
+        urls = self.urls
+        if self.max_keys and url not in urls and len(urls) + (OTHER_URL not in urls) >= self.max_keys:
+            return OTHER_URL
+        return url
+
+    def add(self, url, acstime):
+        """Add request time of url"""
+        self.total_count += 1
+        self.total_usec += int(round(acstime * TIME_SCALE))
+        if self.normalize:
+            url = normalize_url(url)
+        url = self._key(url)
+        urls = self.urls
+        if self.columns:
+            urls.add(url, acstime)
+        elif self.stream:
+            if url not in urls:
+                urls[url] = UrlStat(self.accuracy)
+            urls[url].add(acstime)
+        elif url not in urls:
+            urls[url] = [acstime]
+        else:
+            urls[url].append(acstime)
+
+    def merge(self, other, copy_values=False):
+        """Merge aggregate of the following part of log, with copy_values url stats of other are not shared"""
+        self.num_line += other.num_line
+        self.count_pass_line += other.count_pass_line
+        self.total_count += other.total_count
+        self.total_usec += other.total_usec
+        urls = self.urls
+        if self.columns:
+            urls.merge(other.urls, self._key)
+            return
+        for url, values in other.urls.items():
+            url = self._key(url)
+            if url not in urls and copy_values:
+                urls[url] = UrlStat(self.accuracy) if self.stream else []
+            if url not in urls:
+                urls[url] = values
+            elif self.stream:
+                urls[url].merge(values)
+            else:
+                urls[url].extend(values)
+
+
+def get_log_files(cfg):
+    """Find all logfiles sorted by date, None if some logfile has bad date"""
+    log_files = []
     for fullname in glob.glob(os.path.join(cfg["LOG_DIR"], "nginx-access-ui.log-*")):
         if os.path.isfile(fullname):
             fname = fullname.split("-")
@@ -40,11 +334,24 @@ def get_last_log_file(cfg):
                 return None
             dt = int(fname[3][:8])
             file_dt = files_dt(fullname, dt)
-            last_files.append(file_dt)
-    if not last_files:
+            log_files.append(file_dt)
+    log_files.sort(key=lambda f: f.date)
+    return log_files
+
+
+def get_last_log_file(cfg):
+    """Find last logfile"""
+    log_files = get_log_files(cfg)
+    if not log_files:
         return None
-    last_file = max(last_files, key=lambda f: f.date)
-    return last_file
+    return log_files[-1]
+
+
+def get_period_log_files(log_files, days):
+    """Select logfiles of days ending at the date of the last logfile"""
+    last_date = datetime.datetime.strptime(str(log_files[-1].date), "%Y%m%d")
+    first_date = int((last_date - datetime.timedelta(days=days - 1)).strftime("%Y%m%d"))
+    return [log for log in log_files if log.date >= first_date]
 
 
 def make_report_name(log_lastfile, cfg, report_format='html'):
@@ -53,60 +360,388 @@ def make_report_name(log_lastfile, cfg, report_format='html'):
     return os.path.join(cfg["REPORT_DIR"], date.strftime("report-%Y.%m.%d.") + report_format)
 
 
-def gen_readlog(filename):
-    """Generator for read log"""
-    log = gzip.open(filename, mode='rt', encoding='utf-8') if filename.endswith(".gz") \
-        else open(filename, mode='r', encoding='utf-8')
-    for line in log:
-        yield line.strip()
+def _decompress_gzip(filename, blocks, stopped):
+    """Thread target: put decompressed blocks of gzip file into queue, then None or exception"""
+    def put(item):
+        """Put item into queue, False if consumer is stopped"""
+        while not stopped.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        with open(filename, mode='rb') as fd:
+            decomp = zlib.decompressobj(GZIP_WBITS)
+            pending = False
+            for data in iter(partial(fd.read, GZIP_BLOCK), b''):
+                while data:
+                    # output is limited too, highly compressed data isn't inflated at once
+                    block = decomp.decompress(data, GZIP_BLOCK)
+                    if block and not put(block):
+                        return
+                    pending = not decomp.eof
+                    if pending:
+                        data = decomp.unconsumed_tail
+                        continue
+                    # next member of multi-member gzip file
+                    data = decomp.unused_data
+                    decomp = zlib.decompressobj(GZIP_WBITS)
+            if pending:
+                # output left when the last input is consumed
+                block = decomp.flush()
+                if block and not put(block):
+                    return
+                pending = not decomp.eof
+            if pending:
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        put(None)
+    except Exception as e:
+        put(e)
+
+
+def gen_gzip_blocks(filename, tool=GZIP_TOOL):
+    """Generator of decompressed blocks of gzip file.
+
+    Decompression runs in parallel with the consumer: in external process (pigz for tool "auto"
+    if found, or given command like zcat) or in background thread with zlib.
+    """
+    if tool == "auto":
+        tool = shutil.which("pigz")
+    if tool:
+        proc = subprocess.Popen([tool, "-dc", filename], stdout=subprocess.PIPE)
+        try:
+            for block in iter(partial(proc.stdout.read, GZIP_BLOCK), b''):
+                yield block
+            if proc.wait() != 0:
+                raise IOError("{} -dc {} failed with code {}".format(tool, filename, proc.returncode))
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        return
+    blocks = queue.Queue(maxsize=GZIP_QUEUE)
+    stopped = threading.Event()
+    thread = threading.Thread(target=_decompress_gzip, args=(filename, blocks, stopped), daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def gen_gzip_lines(filename, tool=GZIP_TOOL):
+    """Generator of lines of gzip file as bytes without line ends"""
+    tail = b''
+    for block in gen_gzip_blocks(filename, tool):
+        lines = block.split(b'\n')
+        lines[0] = tail + lines[0]
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
+def gen_readlog(filename, binary=False):
+    """Generator for read log, in binary mode lines are raw bytes"""
+    if filename.endswith(".gz"):
+        if binary:
+            yield from gen_gzip_lines(filename)
+        else:
+            for line in gen_gzip_lines(filename):
+                yield line.decode('utf-8').strip()
+        return
+    if binary:
+        log = open(filename, mode='rb')
+        for line in log:
+            yield line
+    else:
+        log = open(filename, mode='r', encoding='utf-8')
+        for line in log:
+            yield line.strip()
     log.close()
 
 
-def parse_log(filename, cfg):
-    """Parse log, fill dict {url->list(...)}"""
-    urls = {}
-    total_count = 0
-    total_time = 0
-    num_line = 0
-    count_pass_line = 0
+def parse_line(line):
+    """Parse log line, return (url, request_time) or None for bad line"""
+    line = line.split('"')
+    if len(line) < 2:
+        return None
+    # find HTTP in request
+    if 'HTTP' not in line[1]:
+        return None
+    # spliting request "method uri HTTP/version"
+    request = line[1].split()
+    if len(request) != 3:
+        return None
+    # find request_time
+    line = line[-1].split()
+    if not line:
+        return None
+    check_request_time = line[-1].replace('.', '')
+    if not check_request_time.isdigit():
+        return None
+    return request[1], float(line[-1])
+
+
+def parse_line_bytes(line):
+    """Parse raw ui_short log line, only url is decoded.
+
+    Accepts the same lines as parse_line, except that the request is split only by
+    ASCII whitespace, while str.split() also splits by non-ASCII and \\x1c-\\x1f separators.
+    """
+    request = line.split(b'"', 2)
+    if len(request) < 2:
+        return None
+    # find HTTP in request
+    if b'HTTP' not in request[1]:
+        return None
+    request = request[1].split()
+    if len(request) != 3:
+        return None
+    request_time = line.rsplit(None, 1)[-1]
+    if not request_time.replace(b'.', b'').isdigit():
+        return None
+    return request[1].decode('utf-8', 'replace'), float(request_time)
+
+
+def parse_lines(lines, cfg):
+    """Parse lines of log into LogStat, lines are bytes for cfg["PARSER"] == "bytes".
+
+    Same as LogStat.add for every parsed line, inlined: request time is converted
+    to microseconds and sketch bucket key once per distinct value (nginx logs it in ms).
+    """
+    stat = LogStat(cfg)
+    parse = parse_line_bytes if cfg["PARSER"] == "bytes" else parse_line
+    urls = stat.urls
+    stream = stat.stream
+    columns = stat.columns
+    rekey = stat.normalize or stat.max_keys
+    sketch_key = QuantileSketch(stat.accuracy).key
+    # request time -> (microseconds, sketch bucket key)
+    times = {}
+    num_line = count_pass_line = total_usec = 0
     # method = ("OPTIONS", "GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "TRACE", "CONNECT")
-    for line in gen_readlog(filename):
-        if line == "":
-            continue
-        num_line += 1
-        # pos = line.find("]")
-        line = line.split('"')
-        if len(line) < 2:
-            count_pass_line += 1
-            continue
-        # find HTTP in request
-        if 'HTTP' not in line[1]:
-            count_pass_line += 1
-            continue
-        # spliting request "method uri HTTP/version"
-        request = line[1].split()
-        if len(request) != 3:
-            count_pass_line += 1
-            continue
-        # find request_time
-        line = line[-1].split()
-        if not line:
+    for line in lines:
+        parsed = parse(line)
+        if parsed is None:
+            if not line.strip():
+                continue
+            num_line += 1
             count_pass_line += 1
             continue
-        check_request_time = line[-1].replace('.', '')
-        if not check_request_time.isdigit():
-            count_pass_line += 1
-            continue
-        url, acstime = request[1], float(line[-1])
-        total_count += 1
-        total_time += acstime
-        if url not in urls:
-            urls[url] = [acstime]
+        num_line += 1
+        url, acstime = parsed
+        if rekey:
+            url = stat._key(normalize_url(url) if stat.normalize else url)
+        converted = times.get(acstime)
+        if converted is None:
+            converted = times[acstime] = (int(round(acstime * TIME_SCALE)), sketch_key(acstime))
+        usec, key = converted
+        total_usec += usec
+        if columns:
+            urls.add(url, acstime)
+        elif stream:
+            url_stat = urls.get(url)
+            if url_stat is None:
+                url_stat = urls[url] = UrlStat(stat.accuracy)
+            url_stat.count += 1
+            url_stat.usec_sum += usec
+            if acstime > url_stat.time_max:
+                url_stat.time_max = acstime
+            sketch = url_stat.sketch
+            sketch.count += 1
+            if key is None:
+                sketch.zero_count += 1
+            else:
+                sketch.buckets[key] = sketch.buckets.get(key, 0) + 1
         else:
-            urls[url].append(acstime)
-    if num_line > 0 and count_pass_line / num_line > cfg["ERROR_TRESHOLD"]:
+            values = urls.get(url)
+            if values is None:
+                urls[url] = [acstime]
+            else:
+                values.append(acstime)
+    stat.num_line = num_line
+    stat.count_pass_line = count_pass_line
+    stat.total_count = num_line - count_pass_line
+    stat.total_usec = total_usec
+    return stat
+
+
+def gen_chunks(filename, workers, start=0, end=None):
+    """Split uncompressed log or its byte range into byte ranges (start, end), one per worker"""
+    if end is None:
+        end = os.path.getsize(filename)
+    chunk_size = (end - start) // workers + 1
+    return [(pos, min(pos + chunk_size, end)) for pos in range(start, end, chunk_size)]
+
+
+def gen_readchunk(filename, start, end, binary=False):
+    """Generator for read lines starting in byte range [start, end)"""
+    with open(filename, mode='rb') as log:
+        pos = start
+        if start > 0:
+            # skip the line started in the previous chunk
+            log.seek(start - 1)
+            pos += len(log.readline()) - 1
+        while pos < end:
+            line = log.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield line if binary else line.decode('utf-8').strip()
+
+
+def parse_chunk(chunk, filename, cfg):
+    """Parse byte range of uncompressed log, used by worker processes"""
+    return parse_lines(gen_readchunk(filename, *chunk, binary=cfg["PARSER"] == "bytes"), cfg)
+
+
+def gen_batches(lines, size):
+    """Group lines into lists of size lines"""
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def gen_bounded_map(pool, func, tasks, window):
+    """Results of func for tasks in order, at most window tasks are submitted ahead,
+    so tasks generator is consumed as fast as results are taken"""
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().get()
+        pending.append(pool.apply_async(func, (task,)))
+    while pending:
+        yield pending.popleft().get()
+
+
+def parse_log_parallel(filename, cfg, start=0, end=None):
+    """Parse log in cfg["WORKERS"] processes and merge partial LogStat in log order"""
+    stat = LogStat(cfg)
+    with mp.Pool(cfg["WORKERS"]) as pool:
+        if filename.endswith(".gz"):
+            # this process decompresses, workers parse batches of lines, decompression
+            # waits for workers instead of buffering the whole log in the task queue
+            lines = gen_readlog(filename, binary=cfg["PARSER"] == "bytes")
+            parts = gen_bounded_map(pool, partial(parse_lines, cfg=cfg), gen_batches(lines, BATCH_SIZE),
+                                    cfg["WORKERS"] * BATCH_WINDOW)
+        else:
+            parts = pool.imap(partial(parse_chunk, filename=filename, cfg=cfg),
+                              gen_chunks(filename, cfg["WORKERS"], start, end))
+        for part in parts:
+            stat.merge(part)
+    return stat
+
+
+def read_log_stat(filename, cfg, start=0, end=None):
+    """Parse log into LogStat, byte range [start, end) is supported for uncompressed log"""
+    binary = cfg["PARSER"] == "bytes"
+    if cfg["WORKERS"] > 1:
+        return parse_log_parallel(filename, cfg, start, end)
+    if start == 0 and end is None:
+        return parse_lines(gen_readlog(filename, binary=binary), cfg)
+    return parse_lines(gen_readchunk(filename, start, end, binary=binary), cfg)
+
+
+def stat_to_data(stat, cfg):
+    """Check error treshold, return (total_count, total_time, urls) or None"""
+    if stat.num_line > 0 and stat.count_pass_line / stat.num_line > cfg["ERROR_TRESHOLD"]:
         return None
-    return total_count, total_time, urls
+    return stat.total_count, stat.total_time, stat.urls
+
+
+def parse_log(filename, cfg):
+    """Parse log, fill dict {url->list(...)} or {url->UrlStat} in stream mode"""
+    return stat_to_data(read_log_stat(filename, cfg), cfg)
+
+
+def find_lines_end(filename, start, end):
+    """Find offset after the last complete line in byte range [start, end)"""
+    with open(filename, mode='rb') as log:
+        while end > start:
+            block_start = max(start, end - STATE_BLOCK)
+            log.seek(block_start)
+            pos = log.read(end - block_start).rfind(b'\n')
+            if pos >= 0:
+                return block_start + pos + 1
+            end = block_start
+    return start
+
+
+def get_state_name(filename, cfg):
+    """Make name of aggregate state file for log, it is stored next to cfg["TS_FILE"]"""
+    return os.path.join(os.path.dirname(cfg["TS_FILE"]), os.path.basename(filename) + ".state")
+
+
+def get_state_settings(cfg):
+    """Settings which must match to reuse saved aggregate state"""
+    return [cfg[key] for key in ("AGGREGATION", "SKETCH_ACCURACY", "URL_NORMALIZE", "URL_MAX_KEYS")]
+
+
+def load_state(filename, cfg):
+    """Load aggregate state of log, return None if it is absent or made with other settings"""
+    name = get_state_name(filename, cfg)
+    if not os.path.exists(name):
+        return None
+    with open(name, 'rb') as fd:
+        state = pickle.load(fd)
+    if state["settings"] != get_state_settings(cfg):
+        return None
+    return state
+
+
+def save_state(filename, cfg, state):
+    """Save aggregate state of log"""
+    name = get_state_name(filename, cfg)
+    with open(name + ".tmp", 'wb') as fd:
+        pickle.dump(state, fd, pickle.HIGHEST_PROTOCOL)
+    os.replace(name + ".tmp", name)
+
+
+def update_log_stat(filename, cfg):
+    """Parse only the part of log appended since the saved state, return (LogStat, changed)"""
+    size = os.path.getsize(filename)
+    state = load_state(filename, cfg)
+    if state is not None and state["size"] == size:
+        return state["stat"], False
+    if state is None or state["offset"] > size or filename.endswith(".gz"):
+        # new, truncated or compressed log is parsed from the beginning
+        state = {"settings": get_state_settings(cfg), "offset": 0, "size": 0, "stat": LogStat(cfg)}
+    if filename.endswith(".gz"):
+        state["stat"] = read_log_stat(filename, cfg)
+        state["offset"] = size
+    else:
+        end = find_lines_end(filename, state["offset"], size)
+        logging.info("Parse \'{}\' from offset {} to {}".format(filename, state["offset"], end))
+        state["stat"].merge(read_log_stat(filename, cfg, state["offset"], end))
+        state["offset"] = end
+    state["size"] = size
+    save_state(filename, cfg, state)
+    return state["stat"], True
+
+
+def merge_log_stats(logs, cfg):
+    """Merge daily aggregates of logs, raw log is parsed only if its state is absent or stale"""
+    stat = LogStat(cfg)
+    for log in logs:
+        stat.merge(update_log_stat(log.fullname, cfg)[0])
+    return stat
 
 
 def median(values):
@@ -118,43 +753,139 @@ def median(values):
         return values[int((len(values) // 2))]
 
 
+def percentile(values, q):
+    """Compute q-quantile (nearest rank) for sorted list"""
+    return values[max(int(math.ceil(q * len(values))) - 1, 0)]
+
+
+def usec_sum(values):
+    """Sum of request times in integer microseconds"""
+    return sum(int(round(value * TIME_SCALE)) for value in values)
+
+
+def get_time_sum(values):
+    """Compute time_sum for list of request times or UrlStat"""
+    if isinstance(values, UrlStat):
+        return values.time_sum
+    return usec_sum(values) / TIME_SCALE
+
+
+def get_url_stat(values):
+    """Compute count, time_sum, time_max, time_med, [time_pNN] for list of request times or UrlStat"""
+    if isinstance(values, UrlStat):
+        sketch = values.sketch
+        # estimates of the largest values can be above the exact max
+        return (values.count, values.time_sum, values.time_max, min(sketch.median(), values.time_max),
+                [min(sketch.quantile(q / 100.0), values.time_max) for q in PERCENTILES])
+    values = sorted(values)
+    return (len(values), get_time_sum(values), values[-1], median(values),
+            [percentile(values, q / 100.0) for q in PERCENTILES])
+
+
+def make_row(url, url_stat, total_count, total_time):
+    """Make report row from (count, time_sum, time_max, time_med, [time_pNN]) of url"""
+    count_digits = 3
+    count, url_sum, url_max, url_med, url_percentiles = url_stat
+    time_sum = round(url_sum, count_digits)
+    row = {
+        "url": url,
+        "count": count,
+        "count_perc": round(100 * float(count) / total_count, count_digits),
+        "time_avg": round(url_sum / count, count_digits),
+        "time_max": round(url_max, count_digits),
+        "time_med": round(url_med, count_digits),
+        "time_perc": round(100 * time_sum / total_time, count_digits),
+        "time_sum": time_sum,
+    }
+    for q, value in zip(PERCENTILES, url_percentiles):
+        row["time_p{}".format(q)] = round(value, count_digits)
+    return row
+
+
+def process_columns(data, cfg):
+    """Process data of numpy backend with vectorized grouping of columns"""
+    count_digits = 3
+    total_count, total_time, urls = data
+    if not urls:
+        return []
+    ids = np.frombuffer(urls.ids, dtype=np.uint32)
+    times = np.frombuffer(urls.times, dtype=np.float64)
+    # sort by url id, then by request time
+    order = np.lexsort((times, ids))
+    ids, times = ids[order], times[order]
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    counts = np.diff(np.r_[starts, len(ids)])
+    usec_sums = np.add.reduceat(np.rint(times * TIME_SCALE).astype(np.int64), starts)
+    size = cfg["REPORT_SIZE"]
+    candidates = np.arange(len(starts))
+    if len(starts) > size:
+        kth = np.partition(usec_sums, len(starts) - size)[len(starts) - size]
+        # sums less than 1 ms below the smallest kept sum can be equal to it after rounding
+        candidates = np.flatnonzero(usec_sums >= kth - TIME_SCALE // 10 ** count_digits)
+    # the same rounded key and order of ties (first seen url) as heapq.nlargest in process_data
+    rounded = np.array([round(value / TIME_SCALE, count_digits) for value in usec_sums[candidates].tolist()])
+    top = candidates[np.lexsort((ids[starts][candidates], -rounded))[:size]]
+    names = urls.names
+    result = []
+    for group in top.tolist():
+        start, count = int(starts[group]), int(counts[group])
+        values = times[start:start + count].tolist()
+        url_stat = (count, int(usec_sums[group]) / TIME_SCALE, values[-1], median(values),
+                    [percentile(values, q / 100.0) for q in PERCENTILES])
+        result.append(make_row(names[int(ids[start])], url_stat, total_count, total_time))
+    return result
+
+
 def process_data(data, cfg):
     """Process data"""
     count_digits = 3
     total_count, total_time, urls = data
-    result = []
-    for url in urls:
-        count = len(urls[url])
-        count_perc = round(100 * float(count) / total_count, count_digits)
-        time_avg = round(sum(urls[url]) / count, count_digits)
-        time_max = round(max(urls[url]), count_digits)
-        time_med = round(median(sorted(urls[url])), count_digits)
-        time_sum = round(sum(urls[url]), count_digits)
-        time_perc = round(100 * time_sum / total_time, count_digits)
-        result.append({
-            "url": url,
-            "count": count,
-            "count_perc": count_perc,
-            "time_avg": time_avg,
-            "time_max": time_max,
-            "time_med": time_med,
-            "time_perc": time_perc,
-            "time_sum": time_sum,
-        })
-    result.sort(key=lambda f: f['time_sum'], reverse=True)
-    return result[:cfg["REPORT_SIZE"]]
-
-
-def save_report(filename, data):
-    """Save report"""
+    if isinstance(urls, UrlColumns):
+        return process_columns(data, cfg)
+    # medians and rows are computed only for REPORT_SIZE urls with the largest time_sum
+    top_urls = heapq.nlargest(cfg["REPORT_SIZE"], urls,
+                              key=lambda url: round(get_time_sum(urls[url]), count_digits))
+    return [make_row(url, get_url_stat(urls[url]), total_count, total_time) for url in top_urls]
+
+
+def write_html_report(rpt, data, template):
+    """Write rows into template, json of rows is written row by row in place of $table_json"""
+    with open(template, 'r') as tmpl:
+        head, sep, tail = tmpl.read().partition(TABLE_JSON)
+    rpt.write(head)
+    if sep:
+        rpt.write('[')
+        for num, row in enumerate(data):
+            if num:
+                rpt.write(', ')
+            rpt.write(json.dumps(row))
+        rpt.write(']')
+    rpt.write(tail)
+
+
+def write_jsonl_report(rpt, data):
+    """Write rows as JSON lines"""
+    for row in data:
+        rpt.write(json.dumps(row))
+        rpt.write('\n')
+
+
+def save_report(filename, data, cfg):
+    """Save report, format is given by extension: .html, .jsonl, optionally compressed .gz,
+    html report is made from cfg["TEMPLATE"]"""
     if not data:
         return None
-    with open(config['TEMPLATE'], 'r') as tmpl:
-        lines = tmpl.read()
-    s = Template(lines)
-    s = s.safe_substitute(table_json=json.dumps(data))
-    with open(filename, 'w') as rpt:
-        rpt.write(s)
+    tmp_filename = filename + ".tmp"
+    if filename.endswith(".gz"):
+        rpt = gzip.open(tmp_filename, mode='wt', encoding='utf-8')
+    else:
+        rpt = open(tmp_filename, mode='w', encoding='utf-8')
+    with rpt:
+        if filename.endswith((".jsonl", ".jsonl.gz")):
+            write_jsonl_report(rpt, data)
+        else:
+            write_html_report(rpt, data, cfg["TEMPLATE"])
+    os.replace(tmp_filename, filename)
 
 
 def read_config(filename):
@@ -164,34 +895,201 @@ def read_config(filename):
         for line in conf:
             tmp = line.split(':')
             result[tmp[0]] = tmp[1].strip()
-        if "REPORT_SIZE" in result:
-            result["REPORT_SIZE"] = int(result["REPORT_SIZE"])
-        if "ERROR_TRESHOLD" in result:
-            result["ERROR_TRESHOLD"] = float(result["ERROR_TRESHOLD"])
+        for key, value_type in CONFIG_TYPES.items():
+            if key in result:
+                result[key] = value_type(result[key])
     return result
 
 
-def main(cfg):
-    """python log_analyzer.py --config filename.conf"""
-    log = get_last_log_file(cfg)
-    if log is None:
-        logging.error("Can't find last log")
-        return
-    logging.info("Find last log: \'{}\'.".format(log.fullname))
-    report = make_report_name(log, cfg)
+class RollingStat(object):
+    """LogStat buckets of `bucket` seconds for sliding windows over the last minutes.
+
+    Window of N minutes covers the last N * 60 // bucket buckets including the
+    current one, so it starts at most `bucket` seconds later than now - N minutes.
+    """
+
+    def __init__(self, cfg, minutes=max(FOLLOW_WINDOWS), bucket=FOLLOW_BUCKET):
+        self.cfg = cfg
+        self.bucket = bucket
+        self.size = minutes * 60 // bucket
+        self.buckets = deque()
+
+    def add(self, url, acstime, now):
+        """Add request time of url read at time now"""
+        num = int(now // self.bucket)
+        if not self.buckets or self.buckets[-1][0] != num:
+            self.buckets.append((num, LogStat(self.cfg)))
+        while self.buckets[0][0] <= num - self.size:
+            self.buckets.popleft()
+        self.buckets[-1][1].add(url, acstime)
+
+    def window(self, minutes, now):
+        """Merge buckets of the last minutes into new LogStat, buckets are not changed"""
+        num = int(now // self.bucket)
+        size = minutes * 60 // self.bucket
+        stat = LogStat(self.cfg)
+        for bucket_num, bucket in self.buckets:
+            if bucket_num > num - size:
+                stat.merge(bucket, copy_values=True)
+        return stat
+
+
+def gen_follow(filename, poll=FOLLOW_POLL):
+    """Generator of complete lines appended to log, yields None when there are no new lines.
+
+    Log rotation is detected by inode change: the old file is read to the end
+    and the new one is read from the beginning.
+    """
+    log = None
+    from_start = False
+    tail = b''
+    while True:
+        if log is None:
+            try:
+                log = open(filename, mode='rb')
+            except FileNotFoundError:
+                from_start = True
+                yield None
+                time.sleep(poll)
+                continue
+            if not from_start:
+                log.seek(0, os.SEEK_END)
+        line = log.readline()
+        if line:
+            if line.endswith(b'\n'):
+                yield tail + line
+                tail = b''
+            else:
+                tail += line
+            continue
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            st = None
+        if st is None or st.st_ino != os.fstat(log.fileno()).st_ino:
+            logging.info("Log \'{}\' is rotated".format(filename))
+            log.close()
+            log = None
+            from_start = True
+            tail = b''
+            continue
+        if st.st_size < log.tell():
+            # truncated in place
+            log.seek(0)
+        yield None
+        time.sleep(poll)
+
+
+def save_live_reports(rolling, cfg, now):
+    """Save reports report-live-<N>m of sliding windows, report of empty window is removed"""
+    for minutes in FOLLOW_WINDOWS:
+        stat = rolling.window(minutes, now)
+        report = os.path.join(cfg["REPORT_DIR"], "report-live-{}m.{}".format(minutes, cfg["REPORT_FORMAT"]))
+        if not stat.total_count:
+            if os.path.exists(report):
+                os.remove(report)
+            continue
+        save_report(report, process_data((stat.total_count, stat.total_time, stat.urls), cfg), cfg)
+
+
+def follow_log(cfg):
+    """Tail cfg["FOLLOW_FILE"] and refresh reports of sliding windows every cfg["FOLLOW_INTERVAL"] seconds"""
+    # bounded memory: sketches instead of request times and limited number of urls
+    cfg = dict(cfg, AGGREGATION="stream", WORKERS=1, URL_MAX_KEYS=cfg["URL_MAX_KEYS"] or FOLLOW_MAX_KEYS)
+    rolling = RollingStat(cfg)
+    binary = cfg["PARSER"] == "bytes"
+    parse = parse_line_bytes if binary else parse_line
+    next_report = time.time() + cfg["FOLLOW_INTERVAL"]
+    logging.info("Follow log \'{}\'".format(cfg["FOLLOW_FILE"]))
+    try:
+        for line in gen_follow(cfg["FOLLOW_FILE"]):
+            now = time.time()
+            if line is not None:
+                parsed = parse(line if binary else line.decode('utf-8').strip())
+                if parsed is not None:
+                    rolling.add(parsed[0], parsed[1], now)
+            if now >= next_report:
+                save_live_reports(rolling, cfg, now)
+                next_report = now + cfg["FOLLOW_INTERVAL"]
+    except KeyboardInterrupt:
+        logging.info("Follow log is stopped")
+
+
+def build_report(log, cfg):
+    """Parse log and save its report, return False if log can't be parsed"""
+    report = make_report_name(log, cfg, cfg["REPORT_FORMAT"])
     logging.info("Make report filename: \'{}\'.".format(report))
-    if os.path.exists(report):
-        logging.info('Report already exists \'{0}\'.'.format(report))
-        return
-    logging.info("Parse log")
-    data = parse_log(log.fullname, cfg)
+    if cfg["INCREMENTAL"]:
+        stat, changed = update_log_stat(log.fullname, cfg)
+        if not changed and os.path.exists(report):
+            logging.info('Report is up to date \'{0}\'.'.format(report))
+            return True
+    else:
+        if os.path.exists(report):
+            logging.info('Report already exists \'{0}\'.'.format(report))
+            return True
+        logging.info("Parse log \'{}\'".format(log.fullname))
+        stat = read_log_stat(log.fullname, cfg)
+    data = stat_to_data(stat, cfg)
     if data is None:
         logging.error("Can't parse log {}".format(log.fullname))
-        sys.exit(1)
+        return False
     logging.info("Analyze start")
     result = process_data(data, cfg)
     logging.info("Save report")
-    save_report(report, result)
+    save_report(report, result, cfg)
+    return True
+
+
+def build_reports(logs, cfg):
+    """Build reports of all unreported logs in cfg["WORKERS"] processes"""
+    if not cfg["INCREMENTAL"]:
+        logs = [log for log in logs if not os.path.exists(make_report_name(log, cfg, cfg["REPORT_FORMAT"]))]
+    logging.info("Build reports of {} logs".format(len(logs)))
+    if not logs:
+        return True
+    # workers don't inherit logging setup with spawn or forkserver start method
+    with mp.Pool(min(cfg["WORKERS"], len(logs)), initializer=setup_logging, initargs=(cfg["LOG_FILE"],)) as pool:
+        # every log is parsed in one process
+        results = pool.map(partial(build_report, cfg=dict(cfg, WORKERS=1)), logs)
+    return all(results)
+
+
+def setup_logging(filename):
+    """Configure logging into filename, None for stderr"""
+    logging.basicConfig(format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S',
+                        level=logging.INFO, filename=filename)
+
+
+def main(cfg, days=1, batch=False, follow=False):
+    """python log_analyzer.py --config filename.conf [--days N] [--batch] [--follow]"""
+    if follow:
+        follow_log(cfg)
+        return
+    if batch:
+        logs = get_log_files(cfg)
+        if not logs:
+            logging.error("Can't find logs")
+            return
+        if not build_reports(logs, cfg):
+            sys.exit(1)
+    else:
+        log = get_last_log_file(cfg)
+        if log is None:
+            logging.error("Can't find last log")
+            return
+        logging.info("Find last log: \'{}\'.".format(log.fullname))
+        if days > 1:
+            report = make_report_name(log, cfg, "{}d.{}".format(days, cfg["REPORT_FORMAT"]))
+            logs = get_period_log_files(get_log_files(cfg), days)
+            logging.info("Merge aggregates of {} logs".format(len(logs)))
+            data = stat_to_data(merge_log_stats(logs, cfg), cfg)
+            if data is None:
+                logging.error("Can't parse logs for {}".format(report))
+                sys.exit(1)
+            save_report(report, process_data(data, cfg), cfg)
+        elif not build_report(log, cfg):
+            sys.exit(1)
     logging.info("log_analyzer is finished")
     with open(cfg["TS_FILE"], 'w') as ts:
         ts.write(str(datetime.datetime.now().timestamp()))
@@ -200,15 +1098,20 @@ if __name__ == "__main__":
     # parsing arguments
     parser = argparse.ArgumentParser()
     parser.add_argument("--config", dest="conf", type=str, default="log_analyzer.conf")
+    parser.add_argument("--days", dest="days", type=int, default=1,
+                        help="report for several days from stored aggregates")
+    parser.add_argument("--batch", dest="batch", action="store_true",
+                        help="build reports of all unreported logs in parallel")
+    parser.add_argument("--follow", dest="follow", action="store_true",
+                        help="tail current log and refresh reports of the last 1/5/15 minutes")
     args = parser.parse_args()
 
     # parse config
     config.update(read_config(args.conf))
 
-    logging.basicConfig(format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S',
-                        level=logging.INFO, filename=config["LOG_FILE"])
+    setup_logging(config["LOG_FILE"])
     try:
-        main(config)
+        main(config, args.days, args.batch, args.follow)
     except:
         logging.exception("Runtime error:")
         sys.exit(1)
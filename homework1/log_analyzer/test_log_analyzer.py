@@ -1,7 +1,13 @@
 import unittest
 import os
+import gzip
+import shutil
+import json
+import tempfile
 import log_analyzer as la
 from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+from string import Template
 
 config = {
     "REPORT_SIZE": 1000,
@@ -10,7 +16,17 @@ config = {
     "TEMPLATE": "./reports/report.html",
     "LOG_FILE": "log_analyzer.log",
     "TS_FILE": "log_analyzer.ts",
-    "ERROR_TRESHOLD": 0.75
+    "ERROR_TRESHOLD": 0.75,
+    "AGGREGATION": "exact",
+    "SKETCH_ACCURACY": 0.01,
+    "WORKERS": 1,
+    "PARSER": "bytes",
+    "INCREMENTAL": False,
+    "URL_NORMALIZE": False,
+    "URL_MAX_KEYS": 0,
+    "REPORT_FORMAT": "html",
+    "FOLLOW_FILE": "./log/nginx-access-ui.log",
+    "FOLLOW_INTERVAL": 60
 }
 
 
@@ -24,6 +40,14 @@ class TestLogAnalyzer(unittest.TestCase):
         self.assertNotEqual(la.median([1, 2, 3, 4, 5, 6]), 4.5)
         self.assertEqual(la.median(sorted([3, 2, 1, 4, 5])), 3)
 
+    def test_percentile(self):
+        """test log_analyzer.percentile"""
+        values = list(range(1, 101))
+        self.assertEqual(la.percentile(values, 0.9), 90)
+        self.assertEqual(la.percentile(values, 0.99), 99)
+        self.assertEqual(la.percentile([5], 0.95), 5)
+        self.assertEqual(la.percentile([1, 2, 3], 0.5), 2)
+
     def test_get_last_log_file(self):
         """test log_analyzer.get_last_log"""
         self.assertEqual(la.get_last_log_file(config).fullname, "./test_log/nginx-access-ui.log-20170830")
@@ -64,6 +88,164 @@ class TestLogAnalyzer(unittest.TestCase):
         self.assertEqual(result[0]["time_sum"], 0.900)
         self.assertEqual(result[0]["time_perc"], 60.000)
 
+    def test_process_data_percentiles(self):
+        """test percentiles of streaming aggregation against exact percentiles"""
+        cfg = dict(config, AGGREGATION="stream")
+        for name in ("nginx-access-ui.log-20170730", "nginx-access-ui.log-20170830"):
+            filename = os.path.join(config["LOG_DIR"], name)
+            exact = la.process_data(la.parse_log(filename, config), config)
+            result = la.process_data(la.parse_log(filename, cfg), cfg)
+            for row, exact_row in zip(result, exact):
+                for q in la.PERCENTILES:
+                    key = "time_p{}".format(q)
+                    self.assertAlmostEqual(row[key], exact_row[key],
+                                           delta=cfg["SKETCH_ACCURACY"] * exact_row[key] + 0.001)
+        self.assertEqual(exact[0]["time_p90"], 0.5)
+        self.assertEqual(exact[0]["time_p99"], 0.5)
+        sketch = la.QuantileSketch(0.02)
+        values = [0.001 * i for i in range(1, 10001)]
+        for value in values:
+            sketch.add(value)
+        for q in (0.5, 0.9, 0.95, 0.99):
+            expected = la.percentile(values, q)
+            self.assertAlmostEqual(sketch.quantile(q), expected, delta=0.02 * expected)
+
+    def test_process_data_top(self):
+        """test log_analyzer.process_data keeps REPORT_SIZE urls in order of time_sum"""
+        urls = {"/a": [0.1], "/b": [0.3], "/c": [0.1, 0.2], "/d": [0.3]}
+        data = (5, 1.0, urls)
+        result = la.process_data(data, dict(config, REPORT_SIZE=10))
+        self.assertEqual([row["url"] for row in result], ["/b", "/c", "/d", "/a"])
+        self.assertEqual(la.process_data(data, dict(config, REPORT_SIZE=2)), result[:2])
+
+    def test_normalize_url(self):
+        """test log_analyzer.normalize_url"""
+        self.assertEqual(la.normalize_url("/api/v2/banner/25019354"), "/api/v2/banner/:id")
+        self.assertEqual(la.normalize_url("/api/1/photogenic_banners/list/?server_name=WIN7RB4"),
+                         "/api/:id/photogenic_banners/list/")
+        self.assertEqual(la.normalize_url("/export/dc7161be3/report/"), "/export/:hex/report/")
+        self.assertEqual(la.normalize_url("/api/v2/slot/4705/groups"), "/api/v2/slot/:id/groups")
+        self.assertEqual(la.normalize_url("/accounts/facebook/"), "/accounts/facebook/")
+
+    def test_parse_log_max_keys(self):
+        """test log_analyzer.parse_log with URL_NORMALIZE and URL_MAX_KEYS"""
+        last_log = la.get_last_log_file(config)
+        result = la.parse_log(last_log.fullname, dict(config, URL_NORMALIZE=True))
+        self.assertEqual(len(result[2]), 3)
+        self.assertEqual(result[2]["/api/v2/banner/:id"], [0.1, 0.3])
+        result = la.parse_log(last_log.fullname, dict(config, URL_MAX_KEYS=2))
+        self.assertEqual(result[0], 5)
+        self.assertEqual(len(result[2]), 2)
+        self.assertEqual(len(result[2][la.OTHER_URL]), 4)
+        stat = la.LogStat(dict(config, URL_MAX_KEYS=2))
+        for part in (la.read_log_stat(last_log.fullname, config), la.read_log_stat(last_log.fullname, config)):
+            stat.merge(part)
+        self.assertEqual(len(stat.urls), 2)
+        self.assertEqual(sum(len(values) for values in stat.urls.values()), 10)
+
+    @unittest.skipIf(la.np is None, "numpy is not installed")
+    def test_process_data_numpy(self):
+        """test log_analyzer.process_data with numpy backend gives the same report as exact mode"""
+        cfg = dict(config, AGGREGATION="numpy")
+        for name in ("nginx-access-ui.log-20170730", "nginx-access-ui.log-20170830"):
+            filename = os.path.join(config["LOG_DIR"], name)
+            expected = la.process_data(la.parse_log(filename, config), config)
+            self.assertEqual(la.process_data(la.parse_log(filename, cfg), cfg), expected)
+            self.assertEqual(la.process_data(la.parse_log(filename, dict(cfg, WORKERS=3)), cfg), expected)
+        data = la.parse_log(filename, dict(cfg, URL_MAX_KEYS=2))
+        self.assertEqual(la.process_data(data, cfg),
+                         la.process_data(la.parse_log(filename, dict(config, URL_MAX_KEYS=2)), config))
+
+    def test_save_report(self):
+        """test log_analyzer.save_report in html, html.gz and jsonl formats"""
+        last_log = la.get_last_log_file(config)
+        result = la.process_data(la.parse_log(last_log.fullname, config), config)
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cfg = dict(config, REPORT_DIR=tmp_dir)
+            with open(config["TEMPLATE"]) as tmpl:
+                expected = Template(tmpl.read()).safe_substitute(table_json=json.dumps(result))
+            report = la.make_report_name(last_log, cfg, "html")
+            la.save_report(report, result, cfg)
+            with open(report) as rpt:
+                self.assertEqual(rpt.read(), expected)
+            report = la.make_report_name(last_log, cfg, "html.gz")
+            la.save_report(report, result, cfg)
+            with gzip.open(report, 'rt') as rpt:
+                self.assertEqual(rpt.read(), expected)
+            report = la.make_report_name(last_log, cfg, "jsonl")
+            self.assertEqual(report, os.path.join(tmp_dir, "report-2017.08.30.jsonl"))
+            la.save_report(report, result, cfg)
+            with open(report) as rpt:
+                self.assertEqual([json.loads(line) for line in rpt], result)
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ["report-2017.08.30.html", "report-2017.08.30.html.gz", "report-2017.08.30.jsonl"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_rolling_stat(self):
+        """test log_analyzer.RollingStat windows"""
+        cfg = dict(config, AGGREGATION="stream")
+        rolling = la.RollingStat(cfg)
+        now = 1000 * 60 + 30
+        rolling.add("/a", 0.1, now - 20 * 60)
+        rolling.add("/a", 0.2, now - 10 * 60)
+        rolling.add("/b", 0.3, now - 3 * 60)
+        rolling.add("/a", 0.5, now - 75)
+        rolling.add("/a", 0.6, now - 45)
+        rolling.add("/a", 0.4, now)
+        self.assertEqual(len(rolling.buckets), 5)
+        # windows slide by buckets of 10 seconds, not by calendar minutes
+        self.assertEqual(rolling.window(1, now).total_count, 2)
+        self.assertEqual(rolling.window(1, now + 20).total_count, 1)
+        self.assertEqual(rolling.window(5, now).total_count, 4)
+        stat = rolling.window(15, now)
+        self.assertEqual(stat.total_count, 5)
+        self.assertEqual(stat.urls["/a"].count, 4)
+        stat.urls["/a"].add(1.0)
+        self.assertEqual(rolling.window(15, now).urls["/a"].count, 4)
+        self.assertEqual(rolling.buckets[-1][1].urls["/a"].count, 1)
+
+    def test_save_live_reports(self):
+        """test log_analyzer.save_live_reports removes reports of empty windows"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cfg = dict(config, AGGREGATION="stream", REPORT_DIR=tmp_dir, REPORT_FORMAT="jsonl")
+            rolling = la.RollingStat(cfg)
+            now = 1000 * 60
+            rolling.add("/a", 0.1, now)
+            la.save_live_reports(rolling, cfg, now)
+            self.assertEqual(sorted(os.listdir(tmp_dir)),
+                             ["report-live-15m.jsonl", "report-live-1m.jsonl", "report-live-5m.jsonl"])
+            la.save_live_reports(rolling, cfg, now + 2 * 60)
+            self.assertEqual(sorted(os.listdir(tmp_dir)), ["report-live-15m.jsonl", "report-live-5m.jsonl"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_gen_follow(self):
+        """test log_analyzer.gen_follow reads appended lines and follows rotation"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, "nginx-access-ui.log")
+            with open(filename, 'wb') as log:
+                log.write(b"old line\n")
+            lines = la.gen_follow(filename, poll=0)
+            self.assertIsNone(next(lines))
+            with open(filename, 'ab') as log:
+                log.write(b"line 1\nline")
+            self.assertEqual(next(lines), b"line 1\n")
+            self.assertIsNone(next(lines))
+            with open(filename, 'ab') as log:
+                log.write(b" 2\n")
+            self.assertEqual(next(lines), b"line 2\n")
+            os.rename(filename, filename + "-20170830")
+            with open(filename, 'wb') as log:
+                log.write(b"line 3\n")
+            self.assertEqual(next(lines), b"line 3\n")
+            self.assertIsNone(next(lines))
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_parse_log_with_error(self):
         result = la.parse_log(os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170730"), config)
         total_sum = 0
@@ -94,5 +276,234 @@ class TestLogAnalyzer(unittest.TestCase):
         result = la.parse_log(os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170230"), config)
         self.assertEqual(result, None)
 
+    def test_quantile_sketch(self):
+        """test log_analyzer.QuantileSketch"""
+        values = [0.001 * i for i in range(1, 1002)]
+        sketch = la.QuantileSketch(0.01)
+        for value in values:
+            sketch.add(value)
+        self.assertAlmostEqual(sketch.median(), la.median(values), delta=0.01 * la.median(values))
+        sketch.add(0)
+        self.assertEqual(sketch.value_at(0), 0.0)
+        other = la.QuantileSketch(0.01)
+        other.merge(sketch)
+        self.assertEqual(other.count, len(values) + 1)
+        self.assertEqual(other.median(), sketch.median())
+
+    def test_parse_log_stream(self):
+        """test log_analyzer.parse_log with streaming aggregation"""
+        cfg = dict(config, AGGREGATION="stream")
+        last_log = la.get_last_log_file(cfg)
+        exact = la.parse_log(last_log.fullname, config)
+        result = la.parse_log(last_log.fullname, cfg)
+        self.assertEqual(result[:2], exact[:2])
+        for url, stat in result[2].items():
+            self.assertEqual(stat.count, len(exact[2][url]))
+            self.assertAlmostEqual(stat.time_sum, sum(exact[2][url]))
+            self.assertEqual(stat.time_max, max(exact[2][url]))
+
+    def test_process_data_stream(self):
+        """test log_analyzer.process_data with streaming aggregation"""
+        cfg = dict(config, AGGREGATION="stream")
+        last_log = la.get_last_log_file(cfg)
+        exact = la.process_data(la.parse_log(last_log.fullname, config), config)
+        result = la.process_data(la.parse_log(last_log.fullname, cfg), cfg)
+        self.assertEqual(len(result), len(exact))
+        for row, exact_row in zip(result, exact):
+            self.assertEqual(row["url"], exact_row["url"])
+            self.assertEqual(row["time_sum"], exact_row["time_sum"])
+            self.assertAlmostEqual(row["time_med"], exact_row["time_med"], delta=0.01 * exact_row["time_med"] + 0.001)
+
+    def test_parse_line_bytes(self):
+        """test log_analyzer.parse_line_bytes gives the same result as log_analyzer.parse_line"""
+        for filename in os.listdir(config["LOG_DIR"]):
+            filename = os.path.join(config["LOG_DIR"], filename)
+            for line in la.gen_readlog(filename, binary=True):
+                self.assertEqual(la.parse_line_bytes(line), la.parse_line(line.decode('utf-8').strip()))
+        cfg = dict(config, PARSER="str")
+        last_log = la.get_last_log_file(cfg)
+        self.assertEqual(la.process_data(la.parse_log(last_log.fullname, cfg), cfg),
+                         la.process_data(la.parse_log(last_log.fullname, config), config))
+
+    def test_parse_line_bytes_edge_cases(self):
+        """test log_analyzer.parse_line_bytes and log_analyzer.parse_line on unusual requests"""
+        prefix = '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] '
+        suffix = ' 200 927 "-" "Lynx/2.8.8dev.9" "-" "1498697422-2190034393-4708-9752759" "dc7161be3" 0.390'
+        requests = ['"GET /a HTTP/1.1"', '"GET  /a  HTTP/1.1"', '"GET\t/a\tHTTP/1.1"', '" GET /a HTTP/1.1 "',
+                    '"GET /HTTPx foo"', '"GET /a HTTP/1.1 extra"', '"GET /a"', '"GET /a http/1.1"',
+                    '"HTTP/1.1"', '""', '"-"']
+        for request in requests:
+            line = prefix + request + suffix
+            self.assertEqual(la.parse_line_bytes((line + '\n').encode('utf-8')), la.parse_line(line), request)
+        self.assertEqual(la.parse_line_bytes((prefix + '"GET /HTTPx foo"' + suffix).encode('utf-8')),
+                         ("/HTTPx", 0.39))
+        self.assertEqual(la.parse_line_bytes((prefix + '"GET /a HTTP/1.1 extra"' + suffix).encode('utf-8')), None)
+        # request without closing quote: request time is the last word of request
+        line = prefix + '"GET /HTTP 0.5'
+        self.assertEqual(la.parse_line_bytes(line.encode('utf-8')), la.parse_line(line))
+        # documented difference: str.split() splits request by non-ASCII whitespace
+        line = prefix + '"GET\u00a0/a HTTP/1.1"' + suffix
+        self.assertEqual(la.parse_line(line), ("/a", 0.39))
+        self.assertEqual(la.parse_line_bytes(line.encode('utf-8')), None)
+
+    def test_gen_gzip_lines(self):
+        """test log_analyzer.gen_gzip_lines with zlib thread and external decompressor"""
+        filename = os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170830")
+        with open(filename, 'rb') as log:
+            data = log.read()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gz_filename = os.path.join(tmp_dir, "nginx-access-ui.log-20170830.gz")
+            # two gzip members, the second without line end at the end
+            with open(gz_filename, 'wb') as gz_log:
+                gz_log.write(gzip.compress(data))
+                gz_log.write(gzip.compress(b"last line"))
+            expected = (data + b"last line").split(b"\n")
+            for tool in (None, "auto") + (("zcat",) if shutil.which("zcat") else ()):
+                self.assertEqual(list(la.gen_gzip_lines(gz_filename, tool)), expected)
+            self.assertEqual(list(la.gen_readlog(gz_filename)), list(la.gen_readlog(filename)) + ["last line"])
+            # highly compressed data is inflated by blocks, so closed reader stops early
+            with open(gz_filename, 'wb') as gz_log:
+                gz_log.write(gzip.compress(data * 2000))
+            self.assertLessEqual(max(len(block) for block in la.gen_gzip_blocks(gz_filename, None)), la.GZIP_BLOCK)
+            lines = la.gen_gzip_lines(gz_filename, None)
+            self.assertEqual(next(lines), expected[0])
+            lines.close()
+            with open(gz_filename, 'wb') as gz_log:
+                gz_log.write(gzip.compress(data)[:-20])
+            with self.assertRaises(EOFError):
+                list(la.gen_gzip_lines(gz_filename, None))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_gen_readchunk(self):
+        """test log_analyzer.gen_chunks and log_analyzer.gen_readchunk cover every line once"""
+        filename = os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170830")
+        lines = list(la.gen_readlog(filename))
+        for workers in range(1, 8):
+            chunks = la.gen_chunks(filename, workers)
+            chunk_lines = [line for chunk in chunks for line in la.gen_readchunk(filename, *chunk)]
+            self.assertEqual(chunk_lines, lines)
+
+    def test_parse_log_parallel(self):
+        """test log_analyzer.parse_log with several workers"""
+        filename = os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170830")
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            gz_filename = os.path.join(tmp_dir, "nginx-access-ui.log-20170830.gz")
+            with open(filename, 'rb') as log, gzip.open(gz_filename, 'wb') as gz_log:
+                shutil.copyfileobj(log, gz_log)
+            for aggregation in ("exact", "stream"):
+                cfg = dict(config, AGGREGATION=aggregation)
+                expected = la.process_data(la.parse_log(filename, cfg), cfg)
+                for name in (filename, gz_filename):
+                    result = la.process_data(la.parse_log(name, dict(cfg, WORKERS=3)), cfg)
+                    self.assertEqual(result, expected)
+        finally:
+            shutil.rmtree(tmp_dir)
+        result = la.parse_log(os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170630"),
+                              dict(config, WORKERS=3))
+        self.assertEqual(result, None)
+
+    def test_gen_bounded_map(self):
+        """test log_analyzer.gen_bounded_map keeps order and takes at most window tasks ahead"""
+        taken = []
+
+        def tasks():
+            for num in range(10):
+                taken.append(num)
+                yield num
+
+        with ThreadPool(2) as pool:
+            results = la.gen_bounded_map(pool, lambda num: num * num, tasks(), 3)
+            self.assertEqual(next(results), 0)
+            self.assertEqual(len(taken), 4)
+            self.assertEqual(list(results), [num * num for num in range(1, 10)])
+
+    def test_update_log_stat(self):
+        """test log_analyzer.update_log_stat parses only appended lines"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cfg = dict(config, AGGREGATION="stream", TS_FILE=os.path.join(tmp_dir, "log_analyzer.ts"))
+            filename = os.path.join(tmp_dir, "nginx-access-ui.log-20170830")
+            with open(os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170830"), 'rb') as log:
+                lines = log.readlines()
+            with open(filename, 'wb') as log:
+                log.writelines(lines[:2])
+                log.write(lines[2][:10])
+            stat, changed = la.update_log_stat(filename, cfg)
+            self.assertTrue(changed)
+            self.assertEqual(stat.total_count, 2)
+            self.assertEqual(la.load_state(filename, cfg)["offset"], len(lines[0]) + len(lines[1]))
+            self.assertFalse(la.update_log_stat(filename, cfg)[1])
+            with open(filename, 'ab') as log:
+                log.write(lines[2][10:])
+                log.writelines(lines[3:])
+            stat, changed = la.update_log_stat(filename, cfg)
+            self.assertTrue(changed)
+            self.assertEqual(la.process_data(la.stat_to_data(stat, cfg), cfg),
+                             la.process_data(la.parse_log(filename, cfg), cfg))
+            self.assertEqual(la.load_state(filename, cfg)["offset"], os.path.getsize(filename))
+            self.assertIsNone(la.load_state(filename, dict(cfg, AGGREGATION="exact")))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_merge_log_stats(self):
+        """test log_analyzer.merge_log_stats for report of several days"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cfg = dict(config, TS_FILE=os.path.join(tmp_dir, "log_analyzer.ts"))
+            logs = la.get_period_log_files(la.get_log_files(cfg), 1)
+            self.assertEqual([log.date for log in logs], [20170830])
+            logs = la.get_period_log_files(la.get_log_files(cfg), 32)
+            self.assertEqual([log.date for log in logs], [20170730, 20170830])
+            stat = la.merge_log_stats(logs, cfg)
+            self.assertEqual(stat.total_count, 9)
+            self.assertEqual(stat.total_time, 2.6)
+            self.assertTrue(os.path.exists(la.get_state_name(logs[0].fullname, cfg)))
+            self.assertEqual(la.merge_log_stats(logs, cfg).urls, stat.urls)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_build_reports(self):
+        """test log_analyzer.build_reports builds every unreported log"""
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            cfg = dict(config, LOG_DIR=tmp_dir, REPORT_DIR=tmp_dir, WORKERS=2)
+            for name in ("nginx-access-ui.log-20170730", "nginx-access-ui.log-20170830"):
+                shutil.copy(os.path.join(config["LOG_DIR"], name), tmp_dir)
+            logs = la.get_log_files(cfg)
+            open(la.make_report_name(logs[0], cfg), 'w').close()
+            self.assertTrue(la.build_reports(logs, cfg))
+            self.assertEqual(os.path.getsize(la.make_report_name(logs[0], cfg)), 0)
+            self.assertGreater(os.path.getsize(la.make_report_name(logs[1], cfg)), 0)
+            shutil.copy(os.path.join(config["LOG_DIR"], "nginx-access-ui.log-20170630"), tmp_dir)
+            self.assertFalse(la.build_reports(la.get_log_files(cfg), cfg))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_build_reports_spawn(self):
+        """test log_analyzer.build_reports takes template from config in spawned workers"""
+        tmp_dir = tempfile.mkdtemp()
+        mp = la.mp
+        try:
+            template = os.path.join(tmp_dir, "template.html")
+            with open(template, 'w') as tmpl:
+                tmpl.write("<table>$table_json</table>")
+            cfg = dict(config, LOG_DIR=tmp_dir, REPORT_DIR=tmp_dir, WORKERS=2, TEMPLATE=template,
+                       LOG_FILE=os.path.join(tmp_dir, "log_analyzer.log"))
+            for name in ("nginx-access-ui.log-20170730", "nginx-access-ui.log-20170830"):
+                shutil.copy(os.path.join(config["LOG_DIR"], name), tmp_dir)
+            la.mp = mp.get_context("spawn")
+            self.assertTrue(la.build_reports(la.get_log_files(cfg), cfg))
+            for log in la.get_log_files(cfg):
+                with open(la.make_report_name(log, cfg)) as rpt:
+                    self.assertTrue(rpt.read().startswith("<table>[{"))
+            with open(cfg["LOG_FILE"]) as log:
+                self.assertIn("Make report filename", log.read())
+        finally:
+            la.mp = mp
+            shutil.rmtree(tmp_dir)
+
 if __name__ == '__main__':
     unittest.main()
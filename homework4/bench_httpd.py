@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmarks of httpd:
+    python bench_httpd.py response --count 200000
+    python bench_httpd.py load --port 8080 --concurrency 50 --requests 10000 --paths / /httptest/dir2/page.html
+    python bench_httpd.py load --port 8080 --concurrency 50 --duration 10 --no-keepalive
+    python bench_httpd.py regression --duration 3 --save before.json
+    python bench_httpd.py regression --duration 3 --baseline before.json
+"""
+
+import os
+import re
+import json
+import time
+import socket
+import asyncio
+import argparse
+import itertools
+import tempfile
+import multiprocessing
+from collections import Counter
+from datetime import datetime
+import httpd
+
+CONTENT_LENGTH_RE = re.compile(rb'\r\ncontent-length:\s*(\d+)', re.IGNORECASE)
+CONNECTION_CLOSE_RE = re.compile(rb'\r\nconnection:\s*close', re.IGNORECASE)
+
+# upper bounds of latency histogram buckets in ms
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, float('inf'))
+PERCENTILES = (50, 90, 99, 99.9)
+
+# files of regression doc root: name and size
+DOC_FILES = (("index.html", 1024), ("page.html", 12 * 1024), ("big.html", 1024 * 1024))
+MODES = ("thread", "epoll")
+
+HEADERS = {
+    'Last-Modified': 'Sun, 18 Oct 2026 05:53:46 GMT',
+    'ETag': '"18df89ecb8ccbb0f-26"',
+    'Accept-Ranges': 'bytes'
+}
+
+# HTTPResponse arguments of typical responses
+RESPONSES = {
+    "page": dict(method="GET", filename="page.html", code=httpd.OK, headers=HEADERS,
+                 body=b"<html><body>Page Sample</body></html>\n", file_offset=0, file_size=None,
+                 content_type=httpd.CONTENT_TYPE['html'], keep_alive=True),
+    "file": dict(method="GET", filename="wikipedia_russia.html", code=httpd.OK, headers=HEADERS,
+                 body=None, file_offset=0, file_size=954824,
+                 content_type=httpd.CONTENT_TYPE['html'], keep_alive=True),
+    "not_found": dict(method="GET", filename="", code=httpd.NOT_FOUND, headers={},
+                      body=httpd.STATUS_CODES[httpd.NOT_FOUND], file_offset=0, file_size=None,
+                      content_type=None, keep_alive=False),
+}
+
+
+def write_response_format(resp):
+    """Previous write_response: str.format of every header, utcnow per response and bytes +="""
+    response = '{} {} {}\r\n'.format(resp.version, resp.code, httpd.STATUS_CODES[resp.code]).encode('utf-8')
+    length = resp.file_size
+    if length is None and resp.body is not None:
+        length = len(resp.body)
+    if resp.code == httpd.NOT_MODIFIED:
+        pass
+    elif length is None or resp.method not in resp.allowed_method:
+        resp.headers['Content-Length'] = 0
+    else:
+        resp.headers['Content-Length'] = length
+        resp.headers['Content-type'] = resp.content_type or httpd.CONTENT_TYPE['text']
+    resp.headers['Date'] = datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S +0000")
+    resp.headers['Connection'] = 'keep-alive' if resp.keep_alive else 'close'
+    resp.headers['Server'] = 'Python Simple Web Server'
+    for (header, content) in resp.headers.items():
+        response += '{}: {}\r\n'.format(header, content).encode('utf-8')
+    response += b'\r\n'
+    if resp.body is not None and resp.method == "GET":
+        response += resp.body.encode('utf-8') if isinstance(resp.body, str) else resp.body
+    resp.response = response
+
+
+def bench_response(kwargs, build, count):
+    """Make count responses with build function, return responses/sec"""
+    start = time.perf_counter()
+    for _ in range(count):
+        resp = httpd.HTTPResponse(allowed_method={'HEAD', 'GET'}, **dict(kwargs, headers=dict(kwargs['headers'])))
+        build(resp)
+    return count / (time.perf_counter() - start)
+
+
+class LoadStats(object):
+    """Latencies, statuses and errors of load run"""
+
+    def __init__(self):
+        self.latencies = []
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.bytes = 0
+        self.duration = 0.0
+
+    def add(self, latency, status, size):
+        self.latencies.append(latency)
+        self.statuses[status] += 1
+        self.bytes += size
+        if status >= 400:
+            self.errors["HTTP {}".format(status)] += 1
+
+    @property
+    def rps(self):
+        return len(self.latencies) / self.duration if self.duration else 0.0
+
+    def percentile(self, q):
+        """Latency percentile q in ms, latencies have to be sorted"""
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, max(0, int(len(self.latencies) * q / 100.0 + 0.5) - 1))
+        return self.latencies[index] * 1000
+
+    def histogram(self):
+        """Counts of latencies by LATENCY_BUCKETS"""
+        counts = [0] * len(LATENCY_BUCKETS)
+        bucket = 0
+        for latency in self.latencies:
+            while latency * 1000 > LATENCY_BUCKETS[bucket]:
+                bucket += 1
+            counts[bucket] += 1
+        return counts
+
+    def summary(self):
+        """Row of regression results"""
+        return {"rps": round(self.rps, 1), "p50": round(self.percentile(50), 3),
+                "p99": round(self.percentile(99), 3), "errors": sum(self.errors.values())}
+
+
+async def read_response(reader):
+    """Read response with Content-Length or until EOF, return (status, size, close)"""
+    head = await reader.readuntil(b'\r\n\r\n')
+    status = int(head.split(b' ', 2)[1])
+    length = CONTENT_LENGTH_RE.search(head)
+    if length:
+        body = await reader.readexactly(int(length.group(1)))
+        close = CONNECTION_CLOSE_RE.search(head) is not None
+    else:
+        body = await reader.read()
+        close = True
+    return status, len(head) + len(body), close
+
+
+async def load_client(host, port, requests, keep_alive, stats):
+    """Send requests for paths from shared iterator one by one, reconnect
+    after every response without keep-alive and after Connection: close"""
+    request = "GET {} HTTP/1.1\r\nHost: {}\r\n\r\n" if keep_alive else "GET {} HTTP/1.0\r\nHost: {}\r\n\r\n"
+    writer = None
+    for path in requests:
+        start = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request.format(path, host).encode())
+            status, size, close = await read_response(reader)
+        except (OSError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, IndexError) as e:
+            stats.errors[type(e).__name__] += 1
+            close = True
+        else:
+            stats.add(time.perf_counter() - start, status, size)
+        if writer is not None and (close or not keep_alive):
+            writer.close()
+            writer = None
+    if writer is not None:
+        writer.close()
+
+
+def gen_requests(paths, count=0, duration=0.0):
+    """Paths round robin until count requests or duration seconds"""
+    deadline = time.perf_counter() + duration if duration else None
+    for num in itertools.count():
+        if count and num >= count or deadline and time.perf_counter() >= deadline:
+            return
+        yield paths[num % len(paths)]
+
+
+def run_load(host, port, paths, concurrency, keep_alive=True, count=0, duration=0.0):
+    """Load server with concurrency clients, return sorted LoadStats"""
+    stats = LoadStats()
+    requests = gen_requests(paths, count, duration)
+
+    async def load():
+        await asyncio.gather(*(load_client(host, port, requests, keep_alive, stats) for _ in range(concurrency)))
+
+    start = time.perf_counter()
+    asyncio.run(load())
+    stats.duration = time.perf_counter() - start
+    stats.latencies.sort()
+    return stats
+
+
+def print_stats(stats):
+    """Print throughput, errors, latency percentiles and histogram"""
+    print("requests: {}, {:.1f} sec, {:.0f} rps, {:.1f} MB/s".format(
+        len(stats.latencies), stats.duration, stats.rps, stats.bytes / stats.duration / 1024 / 1024))
+    print("statuses: {}".format(", ".join("{} {}".format(*item) for item in sorted(stats.statuses.items()))))
+    print("errors: {}".format(", ".join("{} {}".format(*item) for item in stats.errors.most_common()) or 0))
+    if not stats.latencies:
+        return
+    print("latency ms: {}, max {:.2f}".format(
+        ", ".join("p{} {:.2f}".format(q, stats.percentile(q)) for q in PERCENTILES), stats.latencies[-1] * 1000))
+    counts = stats.histogram()
+    for bound, count in zip(LATENCY_BUCKETS, counts):
+        if count:
+            print("{:>10} {:>8} {}".format("<= {:g} ms".format(bound) if bound != float('inf') else "> 1000 ms",
+                                           count, "#" * max(1, 50 * count // max(counts))))
+
+
+def gen_doc_root(path):
+    """Write DOC_FILES to directory path"""
+    for name, size in DOC_FILES:
+        line = "<p>{}</p>\n".format(name)
+        with open(os.path.join(path, name), "w") as f:
+            f.write(line * (size // len(line)))
+
+
+def serve(port, doc_root, workers, mode):
+    """Run TCPServer until SIGTERM"""
+    server = httpd.TCPServer("127.0.0.1", port, doc_root, workers, mode)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.stop_server()
+
+
+def start_server(port, doc_root, workers, mode):
+    """Start TCPServer in child process and wait for listen socket"""
+    process = multiprocessing.Process(target=serve, args=(port, doc_root, workers, mode))
+    process.start()
+    deadline = time.time() + 5
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            if time.time() > deadline or not process.is_alive():
+                process.terminate()
+                raise
+            time.sleep(0.05)
+
+
+def bench_regression(port, workers, concurrency, duration, baseline=None):
+    """Load TCPServer in every mode with and without keep-alive on generated doc root,
+    print results and change of rps against baseline, return results"""
+    results = {}
+    with tempfile.TemporaryDirectory() as doc_root:
+        gen_doc_root(doc_root)
+        for mode in MODES:
+            process = start_server(port, doc_root, workers, mode)
+            try:
+                for keep_alive, (name, size) in itertools.product((True, False), DOC_FILES):
+                    stats = run_load("127.0.0.1", port, ["/" + name], concurrency, keep_alive, duration=duration)
+                    key = "{} {} {}".format(mode, "keep-alive" if keep_alive else "close", name)
+                    results[key] = stats.summary()
+                    change = ""
+                    if baseline and baseline.get(key, {}).get("rps"):
+                        change = "{:+.1f}%".format(100.0 * results[key]["rps"] / baseline[key]["rps"] - 100)
+                    print("{:<28} {rps:>8.0f} rps  p50 {p50:>7.2f} ms  p99 {p99:>7.2f} ms  errors {errors} {}".format(
+                        key, change, **results[key]).rstrip())
+            finally:
+                process.terminate()
+                process.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("bench", choices=("response", "load", "regression"))
+    parser.add_argument("--count", type=int, default=200000, help="responses to build")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--paths", nargs="+", default=["/"], help="paths to request round robin")
+    parser.add_argument("--concurrency", type=int, default=10, help="simultaneous connections")
+    parser.add_argument("--requests", type=int, default=10000, help="requests to send if no --duration")
+    parser.add_argument("--duration", type=float, default=0.0, help="seconds of load, per run for regression")
+    parser.add_argument("--no-keepalive", action="store_true", help="new connection for every request")
+    parser.add_argument("--workers", type=int, default=10, help="server workers for regression")
+    parser.add_argument("--save", help="file for regression results in json")
+    parser.add_argument("--baseline", help="regression results in json to compare with")
+    args = parser.parse_args()
+
+    if args.bench == "response":
+        for name, kwargs in RESPONSES.items():
+            new = bench_response(kwargs, httpd.HTTPResponse.write_response, args.count)
+            old = bench_response(kwargs, write_response_format, args.count)
+            print("{:<10} write_response {:>8.0f}/sec, str.format {:>8.0f}/sec".format(name, new, old))
+    elif args.bench == "load":
+        count = 0 if args.duration else args.requests
+        print_stats(run_load(args.host, args.port, args.paths, args.concurrency,
+                             not args.no_keepalive, count, args.duration))
+    else:
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        results = bench_regression(args.port, args.workers, args.concurrency, args.duration or 3.0, baseline)
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
@@ -1,28 +1,50 @@
 #!/usr/bin/env python
 import argparse
+import bisect
+import calendar
+import copy
+import errno
+import gzip
 import logging
 import os
 import queue
+import re
+import selectors
+import signal
 import socket
 import threading
+import time
+from collections import Counter, OrderedDict, deque
 from urllib.parse import unquote
-from datetime import datetime
 
 # supported status codes
 OK = 200
+PARTIAL_CONTENT = 206
+NOT_MODIFIED = 304
 BAD_REQUEST = 400
 FORBIDDEN = 403
 NOT_FOUND = 404
 NOT_ALLOWED = 405
+RANGE_NOT_SATISFIABLE = 416
+REQUEST_HEADER_FIELDS_TOO_LARGE = 431
+SERVICE_UNAVAILABLE = 503
 
 STATUS_CODES = {
     OK: 'OK',
+    PARTIAL_CONTENT: 'Partial Content',
+    NOT_MODIFIED: 'Not Modified',
     FORBIDDEN: 'Forbidden',
     BAD_REQUEST: 'Bad Request',
     NOT_FOUND: 'Not Found',
-    NOT_ALLOWED: 'Method Not Allowed'
+    NOT_ALLOWED: 'Method Not Allowed',
+    RANGE_NOT_SATISFIABLE: 'Range Not Satisfiable',
+    REQUEST_HEADER_FIELDS_TOO_LARGE: 'Request Header Fields Too Large',
+    SERVICE_UNAVAILABLE: 'Service Unavailable'
 }
 
+# format of Date, Last-Modified and If-Modified-Since
+HTTP_DATE_FORMAT = "%a, %d %b %Y %H:%M:%S GMT"
+
 # supported content types
 CONTENT_TYPE = {
     'text': 'text/plain',
@@ -36,91 +58,179 @@ CONTENT_TYPE = {
     'swf': 'application/x-shockwave-flash'
 }
 
-RECV_BUF = 1024
+RECV_BUF = 8192
+
+# limit of request line and headers, end of headers with LF or CRLF line endings
+MAX_HEADER_SIZE = 8192
+REQUEST_END_RE = re.compile(rb'\r?\n\r?\n')
+
+# server modes: thread pool with blocking sockets or event loop per worker
+MODES = ('thread', 'epoll')
+
+# persistent connections: idle timeout in seconds (0 - close after response) and max requests
+KEEPALIVE_TIMEOUT = 5
+KEEPALIVE_MAX = 100
+# thread mode: seconds between checks of connections queue while keep-alive connection is idle
+IDLE_CHECK_INTERVAL = 0.05
+
+# overload: max connections waiting for worker in thread mode (0 - unbounded), others get 503
+# with Retry-After seconds; seconds to receive request from its first byte (0 - unlimited)
+QUEUE_SIZE = 256
+RETRY_AFTER = 1
+READ_TIMEOUT = 10
+
+# prefork: delay before restart of worker process crashed within RESTART_RESET seconds
+# after start, doubled on every such crash up to RESTART_MAX_DELAY
+RESTART_DELAY = 0.5
+RESTART_MAX_DELAY = 30
+RESTART_RESET = 10
+
+# files up to INLINE_FILE_SIZE bytes are sent with headers in one buffer,
+# bigger ones by os.sendfile, without it by chunks of FILE_CHUNK bytes
+INLINE_FILE_SIZE = 16384
+SENDFILE = hasattr(os, 'sendfile')
+FILE_CHUNK = 65536
+
+# cache of resolved files: size in bytes of cached small files, seconds between
+# stat checks of cached file, cost of entry metadata, cost of request path alias
+# of entry and interval of stats logging
+CACHE_SIZE = 64 * 1024 * 1024
+CACHE_TTL = 1.0
+CACHE_ENTRY_SIZE = 256
+CACHE_ALIAS_SIZE = 128
+CACHE_LOG_INTERVAL = 60
+
+# extensions of text files compressed for Accept-Encoding: gzip, once per cached file up to
+# COMPRESS_MAX_SIZE bytes, not by content type: unknown extensions (.zip, .gz) are served as text/plain
+COMPRESS_EXTENSIONS = {'txt', 'html', 'css', 'js'}
+COMPRESS_MAX_SIZE = 4 * 1024 * 1024
+COMPRESS_LEVEL = 6
+
+# metrics page in Prometheus text format: upper bounds in seconds of latency
+# histogram buckets and histograms by name with help
+METRICS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+METRICS_HISTOGRAMS = OrderedDict([
+    ('queue_wait', 'Time between accept and worker pickup of connection'),
+    ('parse', 'Time of request parsing'),
+    ('file_io', 'Time of file lookup, stat, reading and compression'),
+    ('send', 'Time of sending response'),
+])
+
+# pre-encoded parts of response: status lines, Content-type headers and
+# headers at the end of response by keep-alive flag
+HTTP_VERSION = "HTTP/1.1"
+STATUS_LINES = {code: '{} {} {}\r\n'.format(HTTP_VERSION, code, reason).encode()
+                for code, reason in STATUS_CODES.items()}
+CONTENT_TYPE_HEADERS = {content_type: 'Content-type: {}\r\n'.format(content_type).encode()
+                        for content_type in CONTENT_TYPE.values()}
+RESPONSE_TAILS = {keep_alive: 'Connection: {}\r\nServer: Python Simple Web Server\r\n\r\n'.format(
+                  'keep-alive' if keep_alive else 'close').encode() for keep_alive in (True, False)}
+
+# Date header of current second
+date_header = (0, b'')
 
 
 class HTTPResponse(object):
 
     def __init__(self, **kwargs):
-        self.version = "HTTP/1.1"
+        self.version = HTTP_VERSION
         self.allowed_method = kwargs['allowed_method']
         self.method = kwargs['method']
         self.filename = kwargs['filename']
         self.code = kwargs['code']
-        self.headers = dict()
+        self.headers = dict(kwargs['headers'])
         self.body = kwargs['body']
+        self.file_offset = kwargs['file_offset']
+        self.file_size = kwargs['file_size']
+        self.content_type = kwargs['content_type']
+        self.keep_alive = kwargs['keep_alive']
         self.response = None
-
-    def _get_content_type(self):
-        name, ext = os.path.splitext(self.filename)
-        if ext:
-            return CONTENT_TYPE.get(ext.strip('.'), CONTENT_TYPE['text'])
-        return CONTENT_TYPE['text']
-
-    def _write_data(self, string):
-        """Function to write data into response"""
-        if isinstance(string, str):
-            string = string.encode('utf-8')
-        if self.response is None:
-            self.response = string
-        else:
-            self.response += string
+        # part of file to send after response
+        self.body_offset = 0
+        self.body_size = 0
 
     def write_response(self):
-        """Write the response back to the client """
-        # status line
-        status = '{} {} {}\r\n'.format(self.version,
-                                       self.code,
-                                       STATUS_CODES[self.code])
-        logging.debug("Responding status: {0}".format(status.strip()))
-        self._write_data(status)
-        if self.body is None or self.method not in self.allowed_method:
-            self.headers['Content-Length'] = 0
+        """Write the response back to the client: pre-encoded status line and
+        headers, body of small file, joined once"""
+        logging.debug("Responding status: %s", self.code)
+        parts = [STATUS_LINES[self.code]]
+        if self.headers:
+            parts.append(''.join('{}: {}\r\n'.format(header, content)
+                                 for header, content in self.headers.items()).encode())
+        length = self.file_size
+        if length is None and self.body is not None:
+            length = len(self.body)
+        if self.code == NOT_MODIFIED:
+            pass
+        elif length is None or self.method not in self.allowed_method:
+            parts.append(b'Content-Length: 0\r\n')
         else:
-            self.headers['Content-Length'] = len(self.body)
-            self.headers['Content-type'] = self._get_content_type()
-
-        self.headers['Date'] = datetime.utcnow().strftime("%a, %d %b %Y %H:%M:%S +0000")
-        self.headers['Connection'] = 'close'
-        self.headers['Server'] = 'Python Simple Web Server'
-        for (header, content) in self.headers.items():
-            self._write_data('{}: {}\r\n'.format(header, content))
-        self._write_data('\r\n')
-        # body
+            parts.append(b'Content-Length: %d\r\n' % length)
+            parts.append(CONTENT_TYPE_HEADERS[self.content_type or CONTENT_TYPE['text']])
+        parts.append(get_date_header())
+        parts.append(RESPONSE_TAILS[self.keep_alive])
+        # body, file is sent separately
         if self.body is not None and self.method == "GET":
-            self._write_data(self.body)
+            parts.append(self.body.encode('utf-8') if isinstance(self.body, str) else self.body)
+        self.response = b''.join(parts)
+        if self.file_size is not None and self.method == "GET":
+            self.body_offset = self.file_offset
+            self.body_size = self.file_size
 
 
 class HTTPRequest(object):
 
-    def __init__(self, data, doc_root):
+    def __init__(self, data, doc_root, keep_alive=False, cache=None, metrics=None):
         self.data = data
         self.allowed_method = {'HEAD', 'GET'}
         self.method = ""
         self.url = ""
+        self.version = ""
+        self.keep_alive = keep_alive
         self.filename = ""
         self.doc_root = doc_root
+        self.cache = cache
+        self.metrics = metrics
+        # time of parsed headers before file lookup
+        self.parsed = None
         self.code = OK
+        # request headers by lower case name and headers of response
+        self.headers = dict()
+        self.response_headers = dict()
         self.body = None
+        self.file_offset = 0
+        self.file_size = None
+        self.content_type = None
 
-    def _read_file(self):
-        """Reading file in binary mode"""
-        with open(self.filename, mode='rb') as fd:
-            return fd.read()
+    def _parse_headers(self, request_strings):
+        """Fill headers dict, values of repeated header are joined by comma"""
+        for line in request_strings[1:]:
+            header, sep, value = line.partition(':')
+            if not sep:
+                continue
+            header = header.strip().lower()
+            value = value.strip()
+            if header in self.headers:
+                value = self.headers[header] + ', ' + value
+            self.headers[header] = value
 
     def _invalid_request(self, code, msg):
         """Invalid request"""
         self.code = code
         self.body = str(msg)
-        self.headers = {'Content-Type': 'text/plain'}
+        if code in (BAD_REQUEST, NOT_ALLOWED, REQUEST_HEADER_FIELDS_TOO_LARGE):
+            # request body or garbage may follow, don't read next request
+            self.keep_alive = False
 
-    def _check(self):
+    def _check(self, file_path):
         """Check resource for access"""
-        file_path = unquote(self.url.split('?')[0].strip('/'))
-        filename = os.path.realpath(os.path.join(self.doc_root, file_path))
-        long_prefix = os.path.commonprefix([self.doc_root, filename])
+        try:
+            filename = os.path.realpath(os.path.join(self.doc_root, file_path))
+        except ValueError:
+            # embedded null byte
+            return BAD_REQUEST
         # check root
-        if long_prefix != self.doc_root:
+        if not in_doc_root(self.doc_root, filename):
             return FORBIDDEN
         if os.path.isdir(filename):
             # append index.html
@@ -139,7 +249,11 @@ class HTTPRequest(object):
             logging.info('Invalid http header')
             self._invalid_request(BAD_REQUEST, STATUS_CODES[BAD_REQUEST])
             return
-        request_strings = self.data.splitlines()
+        if len(self.data) > MAX_HEADER_SIZE:
+            logging.info('Too large http header')
+            self._invalid_request(REQUEST_HEADER_FIELDS_TOO_LARGE, STATUS_CODES[REQUEST_HEADER_FIELDS_TOO_LARGE])
+            return
+        request_strings = self.data.decode('utf-8', 'replace').splitlines()
         method_line = request_strings[0].split()
         if len(method_line) != 3:
             logging.info('Invalid http header')
@@ -149,14 +263,90 @@ class HTTPRequest(object):
         self.method = method_line[0]
         # URL
         self.url = method_line[1]
+        # HTTP/1.1 keeps connection by default, HTTP/1.0 only on request
+        self.version = method_line[2]
+        self._parse_headers(request_strings)
+        connection = self.headers.get('connection', '').lower()
+        if self.version == 'HTTP/1.1':
+            self.keep_alive = self.keep_alive and connection != 'close'
+        else:
+            self.keep_alive = self.keep_alive and connection == 'keep-alive'
         if self.method not in self.allowed_method:
             self._invalid_request(NOT_ALLOWED, STATUS_CODES[NOT_ALLOWED])
             return
-        self.code = self._check()
-        if self.code != OK:
-            self._invalid_request(self.code, STATUS_CODES[self.code])
+        if self.metrics and self.url.split('?')[0] == self.metrics.path:
+            self.body = self.metrics.render(self.cache).encode()
+            return
+        self.parsed = time.perf_counter()
+        file_path = unquote(self.url.split('?')[0].strip('/'))
+        entry = self.cache.get(file_path) if self.cache else None
+        if entry is None:
+            self.code = self._check(file_path)
+            if self.code != OK:
+                self._invalid_request(self.code, STATUS_CODES[self.code])
+                return
+            # other request path of cached file
+            entry = self.cache.get_file(self.filename, file_path) if self.cache else None
+        if entry is None:
+            # compress only files kept in cache
+            entry = FileEntry(self.filename, self.doc_root, compress=bool(self.cache))
+            if self.cache:
+                self.cache.put(file_path, entry)
+        if entry.gzip:
+            self.response_headers['Vary'] = 'Accept-Encoding'
+            # ranges are served from identity encoding
+            if accepts_gzip(self.headers.get('accept-encoding', '')) and 'range' not in self.headers:
+                entry = entry.gzip
+                self.response_headers['Content-Encoding'] = 'gzip'
+        self.filename = entry.filename
+        self.content_type = entry.content_type
+        self.response_headers['Last-Modified'] = entry.last_modified
+        self.response_headers['ETag'] = entry.etag
+        self.response_headers['Accept-Ranges'] = 'bytes'
+        if self._not_modified(entry):
+            self.code = NOT_MODIFIED
             return
-        self.body = self._read_file()
+        start, end = 0, entry.size
+        byte_range = self._get_range(entry)
+        if byte_range:
+            start, end = byte_range
+            if start >= entry.size:
+                # error text instead of file: no content type and validators of file
+                self.content_type = None
+                del self.response_headers['Last-Modified']
+                del self.response_headers['ETag']
+                self.response_headers['Content-Range'] = 'bytes */{}'.format(entry.size)
+                self._invalid_request(RANGE_NOT_SATISFIABLE, STATUS_CODES[RANGE_NOT_SATISFIABLE])
+                return
+            self.code = PARTIAL_CONTENT
+            self.response_headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, end - 1, entry.size)
+        if entry.body is not None:
+            self.body = entry.body[start:end] if byte_range else entry.body
+        else:
+            self.file_offset = start
+            self.file_size = end - start
+
+    def _not_modified(self, entry):
+        """Check conditional headers, If-None-Match takes precedence over If-Modified-Since"""
+        if_none_match = self.headers.get('if-none-match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+            return '*' in tags or entry.etag in tags
+        since = parse_http_date(self.headers.get('if-modified-since', ''))
+        return since is not None and int(entry.mtime) <= since
+
+    def _get_range(self, entry):
+        """Requested byte range of GET or None for whole file"""
+        if self.method != 'GET':
+            return None
+        value = self.headers.get('range')
+        if not value:
+            return None
+        if_range = self.headers.get('if-range')
+        if if_range and if_range not in (entry.etag, entry.last_modified):
+            return None
+        return parse_range(value, entry.size)
 
     def to_response(self):
         resp = dict()
@@ -164,51 +354,602 @@ class HTTPRequest(object):
         resp['method'] = self.method
         resp['filename'] = self.filename
         resp['code'] = self.code
+        resp['headers'] = self.response_headers
         resp['body'] = self.body
+        resp['file_offset'] = self.file_offset
+        resp['file_size'] = self.file_size
+        resp['content_type'] = self.content_type
+        resp['keep_alive'] = self.keep_alive
         return resp
 
 
+class FileEntry(object):
+    """Resolved file: metadata, content of small file and gzip variant"""
+
+    def __init__(self, filename, doc_root, compress=False, content_type=None):
+        st = os.stat(filename)
+        self.filename = filename
+        self.doc_root = doc_root
+        self.size = st.st_size
+        self.mtime = st.st_mtime
+        self.last_modified = time.strftime(HTTP_DATE_FORMAT, time.gmtime(st.st_mtime))
+        self.etag = '"{:x}-{:x}"'.format(st.st_mtime_ns, st.st_size)
+        self.content_type = content_type or get_content_type(filename)
+        self.body = None
+        if self.size <= INLINE_FILE_SIZE:
+            with open(filename, mode='rb') as fd:
+                self.body = fd.read()
+        self.checked = time.monotonic()
+        # gzip variant has content type of original file
+        self.gzip = self._get_gzip(compress) if content_type is None else None
+
+    def _get_gzip(self, compress):
+        """Sibling .gz file inside doc root or, if compress, compressed copy of text file,
+        None if there is no variant"""
+        gzip_filename = os.path.realpath(self.filename + '.gz')
+        if os.path.isfile(gzip_filename) and in_doc_root(self.doc_root, gzip_filename):
+            return FileEntry(gzip_filename, self.doc_root, content_type=self.content_type)
+        name, ext = os.path.splitext(self.filename)
+        if not compress or ext.strip('.').lower() not in COMPRESS_EXTENSIONS or self.size > COMPRESS_MAX_SIZE:
+            return None
+        data = self.body
+        if data is None:
+            with open(self.filename, mode='rb') as fd:
+                data = fd.read()
+        data = gzip.compress(data, COMPRESS_LEVEL)
+        if len(data) >= self.size:
+            return None
+        entry = copy.copy(self)
+        entry.body = data
+        entry.size = len(data)
+        entry.etag = self.etag[:-1] + '-gzip"'
+        entry.gzip = None
+        return entry
+
+    def valid(self, ttl):
+        """Check that file and sibling .gz file aren't changed, by stat not more often than once per ttl seconds"""
+        now = time.monotonic()
+        if now - self.checked < ttl:
+            return True
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        if st.st_size != self.size or st.st_mtime != self.mtime:
+            return False
+        # compressed copy in memory shares filename with original
+        if self.gzip and self.gzip.filename != self.filename and not self.gzip.valid(0):
+            return False
+        self.checked = now
+        return True
+
+
+class FileCache(object):
+    """LRU cache of FileEntry by resolved filename with request paths as aliases,
+    bounded by size of cached files, entries metadata and aliases, shared by threads of process"""
+
+    def __init__(self, max_size=CACHE_SIZE, ttl=CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # resolved filename by request path and request paths by filename
+        self.aliases = dict()
+        self.paths = dict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.logged = time.monotonic()
+
+    @staticmethod
+    def _entry_size(entry):
+        size = CACHE_ENTRY_SIZE + (len(entry.body) if entry.body is not None else 0)
+        if entry.gzip and entry.gzip.body is not None:
+            size += CACHE_ENTRY_SIZE + len(entry.gzip.body)
+        return size
+
+    def _remove(self, filename):
+        self.size -= self._entry_size(self.entries.pop(filename))
+        for path in self.paths.pop(filename):
+            del self.aliases[path]
+            self.size -= CACHE_ALIAS_SIZE
+
+    def _add_alias(self, path, filename):
+        previous = self.aliases.get(path)
+        if previous == filename:
+            return
+        if previous is not None:
+            # path is resolved to other file now
+            self.paths[previous].discard(path)
+            self.size -= CACHE_ALIAS_SIZE
+        self.aliases[path] = filename
+        self.paths[filename].add(path)
+        self.size += CACHE_ALIAS_SIZE
+
+    def _evict(self):
+        while self.size > self.max_size:
+            self._remove(next(iter(self.entries)))
+
+    def _get_valid(self, filename):
+        """Valid entry of filename moved to the end of LRU, invalid one is removed"""
+        entry = self.entries.get(filename)
+        if entry is None:
+            return None
+        if not entry.valid(self.ttl):
+            self._remove(filename)
+            return None
+        self.entries.move_to_end(filename)
+        return entry
+
+    def get(self, path):
+        """Return valid entry by request path or None"""
+        with self.lock:
+            filename = self.aliases.get(path)
+            entry = self._get_valid(filename) if filename is not None else None
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+            if time.monotonic() - self.logged >= CACHE_LOG_INTERVAL:
+                self.log_stats()
+        return entry
+
+    def get_file(self, filename, path):
+        """Return valid entry of resolved filename requested by new path or None"""
+        with self.lock:
+            entry = self._get_valid(filename)
+            if entry is not None:
+                self._add_alias(path, filename)
+                self._evict()
+        return entry
+
+    def put(self, path, entry):
+        """Add entry, evict least recently used entries above max size"""
+        with self.lock:
+            if entry.filename in self.entries:
+                self._remove(entry.filename)
+            self.entries[entry.filename] = entry
+            self.paths[entry.filename] = set()
+            self.size += self._entry_size(entry)
+            self._add_alias(path, entry.filename)
+            self._evict()
+
+    def log_stats(self):
+        logging.info("File cache: {} hits, {} misses, {} entries, {} bytes".format(
+            self.hits, self.misses, len(self.entries), self.size))
+        self.logged = time.monotonic()
+
+
+class Histogram(object):
+    """Latency histogram with counts by METRICS_BUCKETS"""
+
+    def __init__(self, buckets=METRICS_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def render(self, name, help):
+        """Lines of histogram with cumulative buckets"""
+        lines = ['# HELP {} {}'.format(name, help), '# TYPE {} histogram'.format(name)]
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            lines.append('{}_bucket{{le="{}"}} {}'.format(name, bound, total))
+        lines.append('{}_sum {:.6f}'.format(name, self.sum))
+        lines.append('{}_count {}'.format(name, total))
+        return lines
+
+
+class Metrics(object):
+    """Counters, gauges and latency histograms of process, shared by threads,
+    rendered in Prometheus text format at path"""
+
+    def __init__(self, path):
+        self.path = path
+        self.requests = Counter()
+        self.bytes_sent = 0
+        self.connections = 0
+        self.active_connections = 0
+        self.histograms = {name: Histogram() for name in METRICS_HISTOGRAMS}
+        # connections queue of thread mode
+        self.queue = None
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds):
+        with self.lock:
+            self.histograms[name].observe(seconds)
+
+    def request(self, code, bytes_sent):
+        with self.lock:
+            self.requests[code] += 1
+            self.bytes_sent += bytes_sent
+
+    def open_connection(self):
+        with self.lock:
+            self.connections += 1
+            self.active_connections += 1
+
+    def close_connection(self):
+        with self.lock:
+            self.active_connections -= 1
+
+    def render(self, cache=None):
+        """Metrics page of process"""
+        lines = ['# HELP httpd_requests_total Responses by status code',
+                 '# TYPE httpd_requests_total counter']
+        with self.lock:
+            lines.extend('httpd_requests_total{{code="{}"}} {}'.format(code, count)
+                         for code, count in sorted(self.requests.items()))
+            values = [
+                ('httpd_response_bytes_total', 'counter', 'Bytes of responses with files', self.bytes_sent),
+                ('httpd_connections_total', 'counter', 'Accepted connections', self.connections),
+                ('httpd_active_connections', 'gauge', 'Open connections', self.active_connections),
+                ('httpd_queue_depth', 'gauge', 'Connections waiting for worker',
+                 self.queue.qsize() if self.queue else 0),
+            ]
+            if cache:
+                values.extend([
+                    ('httpd_cache_hits_total', 'counter', 'File cache hits', cache.hits),
+                    ('httpd_cache_misses_total', 'counter', 'File cache misses', cache.misses),
+                    ('httpd_cache_entries', 'gauge', 'File cache entries', len(cache.entries)),
+                    ('httpd_cache_bytes', 'gauge', 'File cache size', cache.size),
+                ])
+            for name, kind, help, value in values:
+                lines.extend(['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind),
+                              '{} {}'.format(name, value)])
+            for name, help in METRICS_HISTOGRAMS.items():
+                lines.extend(self.histograms[name].render('httpd_{}_seconds'.format(name), help))
+        return '\n'.join(lines) + '\n'
+
+
+class FileBody(object):
+    """Response body streamed from file without reading it into memory"""
+
+    def __init__(self, filename, offset, size):
+        self.file = open(filename, mode='rb')
+        self.offset = offset
+        self.end = offset + size
+        self.sendfile = SENDFILE
+
+    @property
+    def done(self):
+        return self.offset >= self.end
+
+    def _send_chunk(self, sock):
+        """Fallback without sendfile: read chunk at offset and send it"""
+        self.file.seek(self.offset)
+        return sock.send(self.file.read(min(FILE_CHUNK, self.end - self.offset)))
+
+    def send(self, sock):
+        """Send next part of file to non-blocking socket"""
+        if self.sendfile:
+            try:
+                sent = os.sendfile(sock.fileno(), self.file.fileno(), self.offset, self.end - self.offset)
+                if not sent:
+                    raise OSError(errno.EIO, "File is truncated: {}".format(self.file.name))
+                self.offset += sent
+                return
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP):
+                    raise
+                self.sendfile = False
+        self.offset += self._send_chunk(sock)
+
+    def close(self):
+        self.file.close()
+
+
+class RequestReader(object):
+    """Receive buffer of connection, cuts pipelined requests at the end of headers"""
+
+    def __init__(self, max_size=MAX_HEADER_SIZE):
+        self.buffer = bytearray()
+        self.max_size = max_size
+        # end of buffer already searched for end of headers
+        self.scanned = 0
+
+    def feed(self, data):
+        self.buffer += data
+
+    def next_request(self, eof=False):
+        """Return bytes of the first complete request, all buffered bytes if there are
+        more than max size without end of headers or client is gone, otherwise None"""
+        match = REQUEST_END_RE.search(self.buffer, max(self.scanned - 3, 1))
+        if match:
+            end = match.end()
+        elif len(self.buffer) > self.max_size or eof and self.buffer:
+            end = len(self.buffer)
+        else:
+            self.scanned = len(self.buffer)
+            return None
+        request = bytes(self.buffer[:end])
+        del self.buffer[:end]
+        self.scanned = 0
+        return request
+
+
 class TCPWorker(threading.Thread):
 
-    def __init__(self, doc_root, q, q_timeout, **kwargs):
+    def __init__(self, doc_root, q, q_timeout, keepalive_timeout=KEEPALIVE_TIMEOUT, keepalive_max=KEEPALIVE_MAX,
+                 cache=None, metrics=None, read_timeout=READ_TIMEOUT, **kwargs):
         super().__init__(**kwargs)
         self.doc_root = doc_root
         self.queue = q
         self.timeout = q_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_max = keepalive_max
+        self.cache = cache
+        self.metrics = metrics
+        self.read_timeout = read_timeout
         self._stopped = False
 
+    def _wait_next_request(self, conn):
+        """Wait for the next request on idle keep-alive connection, False on
+        timeout or if other connections wait for worker"""
+        deadline = time.monotonic() + self.keepalive_timeout
+        # not select.select, it fails for descriptors over FD_SETSIZE
+        with selectors.DefaultSelector() as selector:
+            selector.register(conn, selectors.EVENT_READ)
+            while True:
+                timeout = min(IDLE_CHECK_INTERVAL, deadline - time.monotonic())
+                if timeout <= 0:
+                    return False
+                if selector.select(timeout):
+                    return True
+                if not self.queue.empty():
+                    return False
+
+    def _recv_timeout(self, reader, request_start):
+        """Timeout of next recv: idle wait without buffered data, otherwise
+        the rest of read timeout of request, socket.timeout if it is over"""
+        if not reader.buffer:
+            return self.keepalive_timeout or self.read_timeout or None
+        if not self.read_timeout:
+            return None
+        timeout = request_start + self.read_timeout - time.monotonic()
+        if timeout <= 0:
+            raise socket.timeout("Request is not received in {} seconds".format(self.read_timeout))
+        return timeout
+
     def _do_work(self, conn):
-        """Processing: get request and send response"""
-        data = ""
+        """Processing: get requests and send responses while connection is kept alive,
+        slow client gets read timeout for every request"""
+        reader = RequestReader()
+        requests = 0
+        # arrival of the first part of request
+        request_start = None
+        eof = False
         while True:
-            buf = conn.recv(RECV_BUF)
-            if not buf:
-                break
-            data += buf.decode('utf-8')
-            if data.find("\r\n\r\n") > 0 or data.find("\n\n") > 0:
-                break
-        if data:
-            httpreq = HTTPRequest(data, self.doc_root)
-            httpreq.parse_data()
-            httpresp = HTTPResponse(**httpreq.to_response())
-            httpresp.write_response()
-            logging.info('{} {} {}'.format(httpreq.url, httpresp.code, len(httpresp.response)))
-            conn.sendall(httpresp.response)
+            data = reader.next_request(eof)
+            if data is None:
+                if eof:
+                    return
+                # idle thread isn't kept for one client while others wait
+                if requests and not reader.buffer and not self._wait_next_request(conn):
+                    return
+                conn.settimeout(self._recv_timeout(reader, request_start))
+                buf = conn.recv(RECV_BUF)
+                if request_start is None:
+                    request_start = time.monotonic()
+                reader.feed(buf)
+                eof = not buf
+                continue
+            request_start = time.monotonic() if reader.buffer else None
+            requests += 1
+            # connection is closed after response if other connections wait for worker
+            keep_alive = keep_alive_allowed(requests, self.keepalive_timeout, self.keepalive_max) \
+                and self.queue.empty()
+            response, body, keep_alive = make_response(data, self.doc_root, keep_alive, self.cache, self.metrics)
+            start = time.perf_counter()
+            try:
+                conn.sendall(response)
+                if body:
+                    # socket.sendfile falls back to send by chunks itself
+                    conn.sendfile(body.file, body.offset, body.end - body.offset)
+            finally:
+                if body:
+                    body.close()
+            if self.metrics:
+                self.metrics.observe('send', time.perf_counter() - start)
+            if not keep_alive:
+                return
 
     def run(self):
         """Main loop for thread, trying queue.get and _do_work"""
         while not self._stopped:
             try:
-                connect = self.queue.get(block=True, timeout=self.timeout)
-                self._do_work(connect)
-                connect.close()
-                self.queue.task_done()
+                connect, accepted = self.queue.get(block=True, timeout=self.timeout)
             except queue.Empty:
                 continue
+            if self.metrics:
+                self.metrics.observe('queue_wait', time.perf_counter() - accepted)
+            try:
+                self._do_work(connect)
             except socket.error:
-                connect.close()
-                self.queue.task_done()
-                continue
+                pass
+            except Exception:
+                # error of one request must not stop the worker
+                logging.exception("Connection failed in {0}".format(self.name))
+            connect.close()
+            if self.metrics:
+                self.metrics.close_connection()
+            self.queue.task_done()
+
+    def stop(self):
+        self._stopped = True
+
+
+class Connection(object):
+    """State of non-blocking connection in event loop"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = RequestReader()
+        self.responses = deque()
+        self.requests = 0
+        # start of sending queued responses and arrival of the first part of request
+        self.send_start = 0.0
+        self.request_start = None
+        self.writing = False
+        self.closing = False
+
+
+class EventLoopWorker(threading.Thread):
+    """Worker with own event loop (epoll on Linux): accepts connections
+    from the shared listening socket and serves all of them without blocking"""
+
+    def __init__(self, doc_root, listen_socket, timeout, keepalive_timeout=KEEPALIVE_TIMEOUT,
+                 keepalive_max=KEEPALIVE_MAX, cache=None, metrics=None, read_timeout=READ_TIMEOUT, **kwargs):
+        super().__init__(**kwargs)
+        self.doc_root = doc_root
+        self.socket = listen_socket
+        self.timeout = timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_max = keepalive_max
+        self.cache = cache
+        self.metrics = metrics
+        self.read_timeout = read_timeout
+        # connections without activity are closed after idle timeout
+        self.idle_timeout = keepalive_timeout or read_timeout
+        self.selector = selectors.DefaultSelector()
+        # connections by time of last activity, oldest first
+        self.active = OrderedDict()
+        self._stopped = False
+
+    def _accept(self):
+        """Accept all pending connections, other workers may take them first"""
+        while True:
+            try:
+                conn, addr = self.socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            conn.setblocking(False)
+            # headers and file are separate sends, don't wait for ACK between them
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            connect = Connection(conn)
+            self.selector.register(conn, selectors.EVENT_READ, connect)
+            self.active[connect] = time.monotonic()
+            if self.metrics:
+                self.metrics.open_connection()
+
+    def _close(self, connect):
+        self.selector.unregister(connect.sock)
+        connect.sock.close()
+        for response in connect.responses:
+            if isinstance(response, FileBody):
+                response.close()
+        self.active.pop(connect, None)
+        if self.metrics:
+            self.metrics.close_connection()
+
+    def _close_idle(self):
+        """Close connections without activity for idle timeout"""
+        deadline = time.monotonic() - self.idle_timeout
+        while self.active:
+            connect, last = next(iter(self.active.items()))
+            if last > deadline:
+                return
+            self._close(connect)
+
+    def _read(self, connect):
+        """Read requests, make responses for all complete requests in buffer"""
+        buf = connect.sock.recv(RECV_BUF)
+        connect.reader.feed(buf)
+        if not buf:
+            connect.closing = True
+        while True:
+            data = connect.reader.next_request(eof=not buf)
+            if data is None:
+                break
+            connect.requests += 1
+            keep_alive = keep_alive_allowed(connect.requests, self.keepalive_timeout, self.keepalive_max)
+            response, body, keep_alive = make_response(data, self.doc_root, keep_alive, self.cache, self.metrics)
+            if not connect.responses:
+                connect.send_start = time.perf_counter()
+            connect.responses.append(memoryview(response))
+            if body:
+                connect.responses.append(body)
+            if not keep_alive:
+                connect.closing = True
+                break
+        if not connect.reader.buffer:
+            connect.request_start = None
+        elif connect.request_start is None:
+            connect.request_start = time.monotonic()
+        elif self.read_timeout and time.monotonic() - connect.request_start > self.read_timeout:
+            # slow client, close after sent responses
+            connect.closing = True
+        if connect.responses:
+            self._write(connect)
+        elif connect.closing:
+            self._close(connect)
+
+    def _write(self, connect):
+        """Send responses as far as socket buffer allows, wait for writable socket for the rest"""
+        while connect.responses:
+            response = connect.responses[0]
+            try:
+                if isinstance(response, FileBody):
+                    response.send(connect.sock)
+                    done = response.done
+                else:
+                    sent = connect.sock.send(response)
+                    done = sent == len(response)
+                    if not done:
+                        connect.responses[0] = response[sent:]
+            except BlockingIOError:
+                done = False
+            if not done:
+                if not connect.writing:
+                    self.selector.modify(connect.sock, selectors.EVENT_WRITE, connect)
+                    connect.writing = True
+                return
+            if isinstance(response, FileBody):
+                response.close()
+            connect.responses.popleft()
+        if self.metrics:
+            self.metrics.observe('send', time.perf_counter() - connect.send_start)
+        if connect.closing:
+            self._close(connect)
+        elif connect.writing:
+            self.selector.modify(connect.sock, selectors.EVENT_READ, connect)
+            connect.writing = False
+
+    def run(self):
+        """Main loop for thread: wait events and process ready sockets"""
+        self.selector.register(self.socket, selectors.EVENT_READ)
+        while not self._stopped:
+            for key, mask in self.selector.select(self.timeout):
+                if key.data is None:
+                    self._accept()
+                    continue
+                connect = key.data
+                self.active[connect] = time.monotonic()
+                self.active.move_to_end(connect)
+                try:
+                    if mask & selectors.EVENT_READ:
+                        self._read(connect)
+                    else:
+                        self._write(connect)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except socket.error:
+                    self._close(connect)
+                except Exception:
+                    # error of one request must not stop the loop with all its connections
+                    logging.exception("Connection failed in {0}".format(self.name))
+                    if connect in self.active:
+                        self._close(connect)
+            if self.idle_timeout:
+                self._close_idle()
+        for key in list(self.selector.get_map().values()):
+            if key.data is not None:
+                key.fileobj.close()
+        self.selector.close()
 
     def stop(self):
         self._stopped = True
@@ -217,54 +958,188 @@ class TCPWorker(threading.Thread):
 class TCPServer(object):
     """Python Web Server"""
 
-    def __init__(self, host, port, doc_root, cnt_threads):
+    def __init__(self, host, port, doc_root, cnt_threads, mode='thread', processes=0,
+                 keepalive_timeout=KEEPALIVE_TIMEOUT, keepalive_max=KEEPALIVE_MAX, cache_size=CACHE_SIZE,
+                 cache_ttl=CACHE_TTL, metrics_path=None, queue_size=QUEUE_SIZE, read_timeout=READ_TIMEOUT):
         self.host = host
         self.port = port
         self.doc_root = doc_root
         self.cnt_threads = cnt_threads
+        self.mode = mode
+        self.processes = processes
+        self.keepalive_timeout = keepalive_timeout
+        self.keepalive_max = keepalive_max
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.cache = None
+        self.metrics_path = metrics_path
+        self.metrics = None
+        self.read_timeout = read_timeout
         self._socket = None
-        self.queue = queue.Queue()
+        self.queue = queue.Queue(queue_size)
         self.threads = []
+        self.workers = dict()
+        # start time and restart delay of worker process by number
+        self.started = dict()
+        self.restart_delays = dict()
         self.timeout = 0.1
         self._stopped = False
 
     def _bind_and_activate(self):
-        """Bind server and make pool threads"""
+        """Bind server socket"""
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self._socket.bind((self.host, self.port))
         self._socket.listen(1024)
+        if self.mode == 'epoll':
+            self._socket.setblocking(False)
         logging.info("Serving HTTP on {0} port {1} (http://{0}:{1}/) ...".format(self.host, self.port))
-        self.threads = [TCPWorker(self.doc_root, self.queue, self.timeout, name="Thread {0}".format(i))
-                        for i in range(self.cnt_threads)]
 
     def _start_threads(self):
-        """Start all threads"""
+        """Make file cache and metrics of process, pool threads and start all threads"""
+        if self.cache_size:
+            self.cache = FileCache(self.cache_size, self.cache_ttl)
+        if self.metrics_path:
+            self.metrics = Metrics(self.metrics_path)
+            self.metrics.queue = self.queue
+        if self.mode == 'epoll':
+            self.threads = [EventLoopWorker(self.doc_root, self._socket, self.timeout, self.keepalive_timeout,
+                                            self.keepalive_max, self.cache, self.metrics, self.read_timeout,
+                                            name="Loop {0}".format(i))
+                            for i in range(self.cnt_threads)]
+        else:
+            self.threads = [TCPWorker(self.doc_root, self.queue, self.timeout, self.keepalive_timeout,
+                                      self.keepalive_max, self.cache, self.metrics, self.read_timeout,
+                                      name="Thread {0}".format(i))
+                            for i in range(self.cnt_threads)]
         for th in self.threads:
             th.start()
             logging.info("Thread is started: {0}".format(th.name))
 
-    def _run_server(self):
-        """Run server"""
-        self._bind_and_activate()
-        self._start_threads()
+    def _serve(self):
+        """Serve connections until stop"""
+        if self.mode == 'epoll':
+            # workers accept themselves, wait for interrupt
+            while not self._stopped:
+                self.threads[0].join(self.timeout)
+            return
+        while not self._stopped:
+            # self._socket.settimeout(0.2)  # timeout for listening
+            conn, addr = self._socket.accept()
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # counted before put, worker may close connection right after it
+            if self.metrics:
+                self.metrics.open_connection()
+            try:
+                self.queue.put((conn, time.perf_counter()), block=False)
+            except queue.Full:
+                if self.metrics:
+                    self.metrics.close_connection()
+                self._reject(conn)
+
+    def _reject(self, conn):
+        """Queue is full: answer 503 without reading request and close connection"""
+        resp = HTTPResponse(allowed_method={'HEAD', 'GET'}, method='GET', filename='', code=SERVICE_UNAVAILABLE,
+                            headers={'Retry-After': RETRY_AFTER}, body=STATUS_CODES[SERVICE_UNAVAILABLE],
+                            file_offset=0, file_size=None, content_type=None, keep_alive=False)
+        resp.write_response()
+        conn.setblocking(False)
+        try:
+            conn.send(resp.response)
+            conn.shutdown(socket.SHUT_WR)
+            # drop received request, close with unread data resets connection before client reads 503
+            conn.recv(RECV_BUF)
+        except OSError:
+            pass
+        conn.close()
+        logging.info("Queue is full, connection is rejected")
+        if self.metrics:
+            self.metrics.request(SERVICE_UNAVAILABLE, len(resp.response))
+
+    def _interrupt(self, signum, frame):
+        """SIGTERM: stop gracefully like on Ctrl-C"""
+        raise KeyboardInterrupt
+
+    def _fork_worker(self, num):
+        """Fork worker process with own threads on the shared listening socket"""
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = num
+            self.started[num] = time.monotonic()
+            logging.info("Process is started: Worker {0} (pid {1})".format(num, pid))
+            return
+        self.workers = dict()
+        code = 0
+        try:
+            self._start_threads()
+            self._serve()
+        except KeyboardInterrupt:
+            pass
+        except Exception:
+            logging.exception("Worker {0} failed".format(num))
+            code = 1
+        finally:
+            try:
+                self.stop_server()
+            finally:
+                os._exit(code)
+
+    def _supervise(self):
+        """Start worker processes and restart crashed ones until stop or exit of all workers"""
+        for num in range(self.processes):
+            self._fork_worker(num)
+        while not self._stopped and self.workers:
+            pid, status = os.wait()
+            num = self.workers.pop(pid, None)
+            if num is None:
+                continue
+            if os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0:
+                logging.info("Process is exited: Worker {0} (pid {1})".format(num, pid))
+                continue
+            delay = self._restart_delay(num)
+            logging.error("Process is crashed: Worker {0} (pid {1}, status {2}), restarting in {3} seconds".format(
+                num, pid, status, delay))
+            time.sleep(delay)
+            self._fork_worker(num)
+
+    def _restart_delay(self, num):
+        """Backoff of worker crashing right after start: 0 or doubled delay"""
+        if time.monotonic() - self.started[num] >= RESTART_RESET:
+            self.restart_delays[num] = 0
+        else:
+            self.restart_delays[num] = min(max(self.restart_delays.get(num, 0) * 2, RESTART_DELAY),
+                                           RESTART_MAX_DELAY)
+        return self.restart_delays[num]
 
     def stop_server(self):
         """Stop server"""
+        self._stopped = True
         for th in self.threads:
             th.stop()
             th.join()
             logging.info("Thread is stopped: {0}".format(th.name))
-        self._stopped = True
+        for pid, num in self.workers.items():
+            try:
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            logging.info("Process is stopped: Worker {0} (pid {1})".format(num, pid))
+        self.workers.clear()
+        if self.cache:
+            self.cache.log_stats()
         self._socket.close()
         logging.info("Serving HTTP is stopped")
 
     def serve_forever(self):
-        """Main loop - listen socket"""
-        self._run_server()
-        while not self._stopped:
-            # self._socket.settimeout(0.2)  # timeout for listening
-            conn, addr = self._socket.accept()
-            self.queue.put(conn, block=False)
+        """Main loop - listen socket, in prefork mode supervise worker processes"""
+        signal.signal(signal.SIGTERM, self._interrupt)
+        self._bind_and_activate()
+        if self.processes:
+            self._supervise()
+            return
+        self._start_threads()
+        self._serve()
 
 
 def log_message(request, response, bytes_sent):
@@ -272,12 +1147,129 @@ def log_message(request, response, bytes_sent):
     return '{} {} {}'.format(request.url, response.code, bytes_sent)
 
 
+def keep_alive_allowed(requests, timeout, max_requests):
+    """Check server limits for keeping connection after request number requests"""
+    return timeout > 0 and requests < max_requests
+
+
+def get_date_header():
+    """Date header line, formatted once per second"""
+    global date_header
+    now = int(time.time())
+    if date_header[0] != now:
+        date_header = (now, 'Date: {}\r\n'.format(time.strftime(HTTP_DATE_FORMAT, time.gmtime(now))).encode())
+    return date_header[1]
+
+
+def in_doc_root(doc_root, filename):
+    """Check that resolved filename is inside doc root"""
+    return os.path.commonprefix([doc_root, filename]) == doc_root
+
+
+def parse_http_date(value):
+    """Timestamp of HTTP date or None"""
+    try:
+        return calendar.timegm(time.strptime(value, HTTP_DATE_FORMAT))
+    except ValueError:
+        return None
+
+
+def parse_range(value, size):
+    """Parse Range header with single byte range, return (start, end) with end
+    excluded, start >= size for unsatisfiable range, or None for invalid and
+    multiple ranges, which are ignored"""
+    unit, sep, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, sep, last = spec.strip().partition('-')
+    if not sep:
+        return None
+    try:
+        if not first:
+            # suffix range: last bytes of file
+            suffix = int(last)
+            return (max(size - suffix, 0), size) if suffix >= 0 else None
+        start = int(first)
+        end = int(last) + 1 if last else size
+    except ValueError:
+        return None
+    if start < 0 or last and end <= start:
+        return None
+    return start, min(end, size)
+
+
+def accepts_gzip(value):
+    """Check Accept-Encoding header for gzip with nonzero quality"""
+    for coding in value.split(','):
+        name, sep, params = coding.partition(';')
+        if name.strip().lower() != 'gzip':
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, sep, number = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(number)
+                except ValueError:
+                    quality = 0.0
+        return quality > 0
+    return False
+
+
+def get_content_type(filename):
+    name, ext = os.path.splitext(filename)
+    if ext:
+        return CONTENT_TYPE.get(ext.strip('.'), CONTENT_TYPE['text'])
+    return CONTENT_TYPE['text']
+
+
+def make_response(data, doc_root, keep_alive=False, cache=None, metrics=None):
+    """Parse request data, return response bytes, FileBody to send after them
+    or None and keep-alive flag of connection"""
+    start = time.perf_counter()
+    httpreq = HTTPRequest(data, doc_root, keep_alive, cache, metrics)
+    httpreq.parse_data()
+    httpresp = HTTPResponse(**httpreq.to_response())
+    httpresp.write_response()
+    built = time.perf_counter()
+    body = FileBody(httpresp.filename, httpresp.body_offset, httpresp.body_size) if httpresp.body_size else None
+    bytes_sent = len(httpresp.response) + httpresp.body_size
+    if metrics:
+        done = time.perf_counter()
+        # file lookup is timed from the end of headers parsing up to opened body file
+        metrics.observe('parse', (httpreq.parsed or built) - start)
+        if httpreq.parsed:
+            metrics.observe('file_io', done - httpreq.parsed)
+        metrics.request(httpresp.code, bytes_sent)
+    logging.info(log_message(httpreq, httpresp, bytes_sent))
+    return httpresp.response, body, httpresp.keep_alive
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Python web server')
     parser.add_argument('-r', required=True, dest='doc_root', help='Document root')
     parser.add_argument('-w', default=1, type=int, dest='workers_count', help='Worker count')
     parser.add_argument('-a', default='localhost', dest='host', help='Web server bind address')
     parser.add_argument('-p', default=8080, type=int, dest='port', help='Web server port')
+    parser.add_argument('-m', default='thread', choices=MODES, dest='mode',
+                        help='Worker mode: thread pool or event loop (epoll) per worker')
+    parser.add_argument('-f', default=0, type=int, dest='processes',
+                        help='Prefork worker processes with -w workers each, 0 - serve in one process')
+    parser.add_argument('-k', default=KEEPALIVE_TIMEOUT, type=float, dest='keepalive_timeout',
+                        help='Keep-alive idle timeout in seconds, 0 - close connection after response')
+    parser.add_argument('-n', default=KEEPALIVE_MAX, type=int, dest='keepalive_max',
+                        help='Max requests per keep-alive connection')
+    parser.add_argument('-c', default=CACHE_SIZE // (1024 * 1024), type=int, dest='cache_size',
+                        help='File cache size in MB per process, 0 - disable cache')
+    parser.add_argument('-t', default=CACHE_TTL, type=float, dest='cache_ttl',
+                        help='Seconds between stat checks of cached file')
+    parser.add_argument('-s', default='', dest='metrics_path',
+                        help='Path of metrics page in Prometheus text format, e.g. /server-metrics, '
+                             'empty - disable metrics')
+    parser.add_argument('-q', default=QUEUE_SIZE, type=int, dest='queue_size',
+                        help='Max connections waiting for worker in thread mode, others get 503, 0 - unbounded')
+    parser.add_argument('-o', default=READ_TIMEOUT, type=float, dest='read_timeout',
+                        help='Seconds to receive request from its first byte, 0 - unlimited')
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO,
                         format='[%(asctime)s] %(levelname).1s %(message)s', datefmt='%Y.%m.%d %H:%M:%S')
@@ -287,7 +1279,16 @@ if __name__ == '__main__':
     httpd = TCPServer(args.host,
                       args.port,
                       os.path.realpath(args.doc_root),
-                      args.workers_count)
+                      args.workers_count,
+                      args.mode,
+                      args.processes,
+                      args.keepalive_timeout,
+                      args.keepalive_max,
+                      args.cache_size * 1024 * 1024,
+                      args.cache_ttl,
+                      args.metrics_path,
+                      args.queue_size,
+                      args.read_timeout)
 
     try:
         httpd.serve_forever()
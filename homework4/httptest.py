@@ -1,21 +1,50 @@
 #!/usr/bin/env python
 
 import re
+import gzip
+import time
 import socket
 import httplib2 as httplib
 import unittest
 
 
 class HttpServer(unittest.TestCase):
+  """ Server is run in one process with metrics page: httpd.py -s /metrics """
   host = "localhost"
   port = 8080
+  # server defaults of -k, -n, -q and -o
+  keepalive_timeout = 5
+  keepalive_max = 100
+  queue_size = 256
+  read_timeout = 10
+  metrics_path = "/metrics"
 
   def setUp(self):
     self.conn = httplib.HTTPConnectionWithTimeout(self.host, self.port, timeout=10)
+    # received bytes of next response
+    self.pending = b""
 
   def tearDown(self):
     self.conn.close()
 
+  def read_response(self, s):
+    """ Read response with Content-Length from socket, return (head, body) """
+    data = self.pending
+    while b"\r\n\r\n" not in data:
+      buf = s.recv(1024)
+      if not buf:
+        break
+      data += buf
+    (head, body) = data.split(b"\r\n\r\n", 1)
+    length = int(re.search(b"Content-Length: (\\d+)", head).group(1))
+    while len(body) < length:
+      buf = s.recv(1024)
+      if not buf:
+        break
+      body += buf
+    self.pending = body[length:]
+    return head.decode('utf-8'), body[:length]
+
   def test_empty_request(self):
     """ Send bad http headers """
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -135,6 +164,21 @@ class HttpServer(unittest.TestCase):
     self.assertIn(b"hello", data)
     self.assertEqual(int(length), 5)
 
+  def test_null_byte_in_path(self):
+    """null byte in path is bad request, server keeps serving other connections"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    for i in range(4):
+      self.conn.request("GET", "/httptest/%00")
+      r = self.conn.getresponse()
+      data = r.read()
+      self.assertIn(int(r.status), (400, 404))
+      self.conn.close()
+    s.sendall("GET /httptest/text..txt HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('utf-8'))
+    (head, body) = self.read_response(s)
+    self.assertEqual(body, b"hello")
+    s.close()
+
   def test_post_method(self):
     """post method forbidden"""
     self.conn.request("POST", "/httptest/dir2/page.html")
@@ -268,6 +312,248 @@ class HttpServer(unittest.TestCase):
     self.assertEqual(len(data), 35344)
     self.assertEqual(ctype, "application/x-shockwave-flash")
 
+  def test_etag_not_modified(self):
+    """If-None-Match with ETag returns 304"""
+    self.conn.request("GET", "/httptest/dir2/page.html")
+    r = self.conn.getresponse()
+    data = r.read()
+    etag = r.getheader("ETag")
+    self.assertIsNotNone(etag)
+    self.conn.request("GET", "/httptest/dir2/page.html", headers={"If-None-Match": etag})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 304)
+    self.assertEqual(len(data), 0)
+    self.assertEqual(r.getheader("ETag"), etag)
+
+  def test_modified_since_not_modified(self):
+    """If-Modified-Since with Last-Modified returns 304"""
+    self.conn.request("GET", "/httptest/dir2/page.html")
+    r = self.conn.getresponse()
+    data = r.read()
+    modified = r.getheader("Last-Modified")
+    self.assertIsNotNone(modified)
+    self.conn.request("GET", "/httptest/dir2/page.html", headers={"If-Modified-Since": modified})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 304)
+    self.assertEqual(len(data), 0)
+
+  def test_modified_since_old_date(self):
+    """If-Modified-Since before Last-Modified returns file"""
+    self.conn.request("GET", "/httptest/dir2/page.html",
+                      headers={"If-Modified-Since": "Thu, 01 Jan 1970 00:00:00 GMT"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(len(data), 38)
+
+  def test_range(self):
+    """Range of bytes returns 206"""
+    self.conn.request("GET", "/httptest/dir2/page.html", headers={"Range": "bytes=6-11"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 206)
+    self.assertEqual(int(r.getheader("Content-Length")), 6)
+    self.assertEqual(r.getheader("Content-Range"), "bytes 6-11/38")
+    self.assertEqual(data, b"<body>")
+
+  def test_range_large_file(self):
+    """Range of large file returns 206"""
+    self.conn.request("GET", "/httptest/wikipedia_russia.html", headers={"Range": "bytes=100000-100999"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 206)
+    self.assertEqual(r.getheader("Content-Range"), "bytes 100000-100999/954824")
+    self.assertEqual(len(data), 1000)
+
+  def test_suffix_range(self):
+    """Suffix range returns last bytes"""
+    self.conn.request("GET", "/httptest/dir2/page.html", headers={"Range": "bytes=-8"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 206)
+    self.assertEqual(r.getheader("Content-Range"), "bytes 30-37/38")
+    self.assertEqual(data, b"</html>\n")
+
+  def test_range_not_satisfiable(self):
+    """Range after the end of file returns 416"""
+    self.conn.request("GET", "/httptest/logo.v2.png", headers={"Range": "bytes=999999-"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 416)
+    self.assertEqual(r.getheader("Content-Range"), "bytes */1754")
+    self.assertEqual(r.getheader("Content-Type"), "text/plain")
+    self.assertIsNone(r.getheader("ETag"))
+
+  def test_gzip_encoding(self):
+    """compressed variant for Accept-Encoding: gzip"""
+    self.conn.request("GET", "/httptest/wikipedia_russia.html", headers={"Accept-Encoding": "gzip"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(r.getheader("Content-Encoding"), "gzip")
+    self.assertEqual(r.getheader("Vary"), "Accept-Encoding")
+    self.assertEqual(r.getheader("Content-Type"), "text/html")
+    self.assertEqual(int(r.getheader("Content-Length")), len(data))
+    data = gzip.decompress(data)
+    self.assertEqual(len(data), 954824)
+    self.assertIn(b"Wikimedia Foundation, Inc.", data)
+
+  def test_gzip_identity(self):
+    """identity encoding without gzip in Accept-Encoding or with q=0"""
+    for headers in ({}, {"Accept-Encoding": "gzip;q=0"}, {"Accept-Encoding": "deflate, gzip; q=0"}):
+      self.conn.request("GET", "/httptest/wikipedia_russia.html", headers=headers)
+      r = self.conn.getresponse()
+      data = r.read()
+      self.assertEqual(int(r.status), 200)
+      self.assertIsNone(r.getheader("Content-Encoding"))
+      self.assertEqual(r.getheader("Vary"), "Accept-Encoding")
+      self.assertEqual(len(data), 954824)
+
+  def test_gzip_range(self):
+    """Range is served from identity encoding"""
+    self.conn.request("GET", "/httptest/wikipedia_russia.html",
+                      headers={"Accept-Encoding": "gzip", "Range": "bytes=0-99"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 206)
+    self.assertIsNone(r.getheader("Content-Encoding"))
+    self.assertEqual(r.getheader("Content-Range"), "bytes 0-99/954824")
+    self.assertEqual(len(data), 100)
+
+  def test_gzip_not_for_images(self):
+    """images are not compressed"""
+    self.conn.request("GET", "/httptest/logo.v2.png", headers={"Accept-Encoding": "gzip"})
+    r = self.conn.getresponse()
+    data = r.read()
+    self.assertEqual(int(r.status), 200)
+    self.assertIsNone(r.getheader("Content-Encoding"))
+    self.assertEqual(len(data), 1754)
+
+  def get_metrics(self):
+    """ Metrics page as dict of series to value """
+    self.conn.request("GET", self.metrics_path)
+    r = self.conn.getresponse()
+    data = r.read().decode('utf-8')
+    self.assertEqual(int(r.status), 200)
+    self.assertEqual(r.getheader("Content-Type"), "text/plain")
+    metrics = {}
+    for line in data.splitlines():
+      if line and not line.startswith("#"):
+        (series, value) = line.rsplit(" ", 1)
+        metrics[series] = float(value)
+    self.assertIn("# TYPE httpd_requests_total counter", data)
+    self.assertIn("# TYPE httpd_parse_seconds histogram", data)
+    return metrics
+
+  def test_metrics(self):
+    """metrics page in Prometheus text format with request counter and histograms"""
+    before = self.get_metrics()
+    self.conn.request("GET", "/httptest/text..txt")
+    r = self.conn.getresponse()
+    r.read()
+    after = self.get_metrics()
+    self.assertGreaterEqual(after['httpd_requests_total{code="200"}'],
+                            before.get('httpd_requests_total{code="200"}', 0) + 2)
+    for name in ("parse", "file_io", "send"):
+      self.assertIn('httpd_{}_seconds_bucket{{le="+Inf"}}'.format(name), after)
+      self.assertIn("httpd_{}_seconds_sum".format(name), after)
+      self.assertEqual(after['httpd_{}_seconds_bucket{{le="+Inf"}}'.format(name)],
+                       after["httpd_{}_seconds_count".format(name)])
+    self.assertGreater(after["httpd_parse_seconds_count"], before["httpd_parse_seconds_count"])
+
+  def test_pipelining(self):
+    """two pipelined requests on one connection"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    s.sendall(("GET /httptest/dir2/page.html HTTP/1.1\r\nHost: localhost\r\n\r\n"
+               "GET /httptest/text..txt HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n").encode('utf-8'))
+    (head, body) = self.read_response(s)
+    self.assertTrue(head.startswith("HTTP/1.1 200"))
+    self.assertIn("Connection: keep-alive", head)
+    self.assertEqual(body, b"<html><body>Page Sample</body></html>\n")
+    (head, body) = self.read_response(s)
+    self.assertTrue(head.startswith("HTTP/1.1 200"))
+    self.assertIn("Connection: close", head)
+    self.assertEqual(body, b"hello")
+    self.assertEqual(s.recv(1024), b"")
+    s.close()
+
+  def test_keepalive_max(self):
+    """connection is closed after max requests"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    for i in range(self.keepalive_max):
+      s.sendall("GET /httptest/text..txt HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('utf-8'))
+      (head, body) = self.read_response(s)
+      self.assertEqual(body, b"hello")
+      if i < self.keepalive_max - 1:
+        self.assertIn("Connection: keep-alive", head)
+    self.assertIn("Connection: close", head)
+    self.assertEqual(s.recv(1024), b"")
+    s.close()
+
+  def test_keepalive_timeout(self):
+    """idle connection is closed after timeout"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    s.sendall("GET /httptest/text..txt HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('utf-8'))
+    (head, body) = self.read_response(s)
+    self.assertIn("Connection: keep-alive", head)
+    start = time.time()
+    s.settimeout(self.keepalive_timeout + 5)
+    self.assertEqual(s.recv(1024), b"")
+    self.assertGreater(time.time() - start, self.keepalive_timeout - 1)
+    s.close()
+
+  def test_read_timeout(self):
+    """slow client is disconnected after read timeout"""
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    s.connect((self.host, self.port))
+    s.settimeout(1)
+    start = time.time()
+    data = b""
+    # one header line per second keeps connection active, but request is never complete
+    while time.time() - start < self.read_timeout + 5:
+      try:
+        s.sendall("X-Slow-{}: 1\r\n".format(int(time.time() - start)).encode('utf-8'))
+        data = s.recv(1024)
+        break
+      except socket.timeout:
+        continue
+      except socket.error:
+        data = b""
+        break
+    s.close()
+    self.assertNotIn(b"200 OK", data)
+    self.assertGreater(time.time() - start, self.read_timeout - 1)
+    self.assertLess(time.time() - start, self.read_timeout + 5)
+
+  def test_queue_full(self):
+    """503 with Retry-After when connection queue is full"""
+    sockets = []
+    try:
+      # idle connections take all workers and fill the queue
+      for i in range(self.queue_size + 16):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.connect((self.host, self.port))
+        sockets.append(s)
+      s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+      sockets.append(s)
+      s.connect((self.host, self.port))
+      s.settimeout(2)
+      try:
+        data = s.recv(1024).decode('utf-8')
+      except socket.timeout:
+        self.skipTest("server doesn't reject connections (epoll mode or -q 0)")
+      self.assertTrue(data.startswith("HTTP/1.1 503"), data)
+      self.assertIn("Retry-After: ", data)
+      self.assertIn("Connection: close", data)
+    finally:
+      for s in sockets:
+        s.close()
+
 loader = unittest.TestLoader()
 suite = unittest.TestSuite()
 a = loader.loadTestsFromTestCase(HttpServer)
@@ -0,0 +1,111 @@
+import unittest
+import os
+import shutil
+import tempfile
+import httpd
+
+
+class TestFileEntry(unittest.TestCase):
+
+    def setUp(self):
+        self.doc_root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.doc_root)
+
+    def make_file(self, name, data):
+        filename = os.path.join(self.doc_root, name)
+        with open(filename, 'wb') as fd:
+            fd.write(data)
+        return filename
+
+    def test_compress_text(self):
+        """test httpd.FileEntry compresses text files"""
+        for name in ("page.html", "style.css", "app.js", "notes.txt", "PAGE.HTML"):
+            entry = httpd.FileEntry(self.make_file(name, b"hello " * 1000), self.doc_root, compress=True)
+            self.assertIsNotNone(entry.gzip, name)
+            self.assertLess(entry.gzip.size, entry.size)
+
+    def test_compress_by_extension(self):
+        """test httpd.FileEntry doesn't compress files of unknown extension served as text/plain"""
+        for name in ("archive.zip", "video.mp4", "doc.pdf", "served.css.gz", "README"):
+            entry = httpd.FileEntry(self.make_file(name, b"hello " * 1000), self.doc_root, compress=True)
+            self.assertEqual(entry.content_type, httpd.CONTENT_TYPE['text'])
+            self.assertIsNone(entry.gzip, name)
+
+
+class TestRequestReader(unittest.TestCase):
+
+    request = b"GET /httptest/page.html HTTP/1.1\r\nHost: localhost\r\n\r\n"
+
+    def test_pipelined_requests(self):
+        """test httpd.RequestReader cuts pipelined requests"""
+        reader = httpd.RequestReader()
+        reader.feed(self.request + self.request.replace(b"\r\n", b"\n") + b"GET /")
+        self.assertEqual(reader.next_request(), self.request)
+        self.assertEqual(reader.next_request(), self.request.replace(b"\r\n", b"\n"))
+        self.assertIsNone(reader.next_request())
+        self.assertEqual(reader.next_request(eof=True), b"GET /")
+        self.assertIsNone(reader.next_request(eof=True))
+
+    def test_end_across_chunks(self):
+        """test httpd.RequestReader finds end of headers split between chunks at any byte"""
+        for request in (self.request, self.request.replace(b"\r\n", b"\n")):
+            for size in (1, 2, 3, 7):
+                reader = httpd.RequestReader()
+                requests = []
+                for pos in range(0, len(request) * 2, size):
+                    reader.feed((request * 2)[pos:pos + size])
+                    data = reader.next_request()
+                    while data is not None:
+                        requests.append(data)
+                        data = reader.next_request()
+                self.assertEqual(requests, [request, request], (request, size))
+                self.assertEqual(reader.buffer, b"")
+
+    def test_max_size(self):
+        """test httpd.RequestReader returns too large request without end of headers"""
+        reader = httpd.RequestReader(max_size=100)
+        reader.feed(b"GET / HTTP/1.1\r\nX-Long: " + b"a" * 76)
+        self.assertIsNone(reader.next_request())
+        reader.feed(b"a")
+        self.assertEqual(len(reader.next_request()), 101)
+        self.assertEqual(reader.buffer, b"")
+
+
+class TestMakeResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.doc_root = tempfile.mkdtemp()
+        with open(os.path.join(self.doc_root, "файл.txt"), 'wb') as fd:
+            fd.write(b"hello")
+
+    def tearDown(self):
+        shutil.rmtree(self.doc_root)
+
+    def test_header_too_large(self):
+        """test httpd.make_response answers 431 and closes connection for too large headers"""
+        reader = httpd.RequestReader()
+        reader.feed(b"GET /file.txt HTTP/1.1\r\nX-Long: " + b"a" * httpd.MAX_HEADER_SIZE)
+        response, body, keep_alive = httpd.make_response(reader.next_request(), self.doc_root, True)
+        self.assertTrue(response.startswith(b"HTTP/1.1 431 "))
+        self.assertIsNone(body)
+        self.assertFalse(keep_alive)
+
+    def test_utf8_across_chunks(self):
+        """test httpd.make_response for UTF-8 path split between chunks"""
+        request = "GET /файл.txt HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('utf-8')
+        # the second byte of the first cyrillic letter
+        pos = request.index("ф".encode('utf-8')) + 1
+        reader = httpd.RequestReader()
+        reader.feed(request[:pos])
+        self.assertIsNone(reader.next_request())
+        reader.feed(request[pos:])
+        response, body, keep_alive = httpd.make_response(reader.next_request(), self.doc_root, True)
+        self.assertTrue(response.startswith(b"HTTP/1.1 200 "))
+        self.assertTrue(response.endswith(b"hello"))
+        self.assertTrue(keep_alive)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 import os
-import gzip
 import sys
+import zlib
+import shutil
+import subprocess
 import glob
 import logging
 import collections
@@ -20,6 +22,12 @@ import memcache
 
 NORMAL_ERR_RATE = 0.01
 MEMCACHE_TIMEOUT = 1
+# gzip reader: block size, decompressed blocks queued by thread, gzip header and trailer for zlib,
+# external decompressor ("auto" - pigz if found, None - zlib in thread)
+GZIP_BLOCK = 1 << 20
+GZIP_QUEUE = 8
+GZIP_WBITS = zlib.MAX_WBITS | 16
+GZIP_TOOL = "auto"
 _sentinel = object()
 AppsInstalled = collections.namedtuple("AppsInstalled", ["dev_type", "dev_id", "lat", "lon", "apps"])
 
@@ -69,6 +77,95 @@ def dot_rename(path):
     os.rename(path, os.path.join(head, "." + fn))
 
 
+def _decompress_gzip(fn, blocks, stopped):
+    """Thread target: put decompressed blocks of gzip file into queue, then None or exception"""
+    def put(item):
+        """Put item into queue, False if consumer is stopped"""
+        while not stopped.is_set():
+            try:
+                blocks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    try:
+        with open(fn, mode="rb") as fd:
+            decomp = zlib.decompressobj(GZIP_WBITS)
+            pending = False
+            for data in iter(lambda: fd.read(GZIP_BLOCK), b""):
+                while data:
+                    # output is limited too, highly compressed data isn't inflated at once
+                    block = decomp.decompress(data, GZIP_BLOCK)
+                    if block and not put(block):
+                        return
+                    pending = not decomp.eof
+                    if pending:
+                        data = decomp.unconsumed_tail
+                        continue
+                    # next member of multi-member gzip file
+                    data = decomp.unused_data
+                    decomp = zlib.decompressobj(GZIP_WBITS)
+            if pending:
+                # output left when the last input is consumed
+                block = decomp.flush()
+                if block and not put(block):
+                    return
+                pending = not decomp.eof
+            if pending:
+                raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+        put(None)
+    except Exception as e:
+        put(e)
+
+
+def gen_gzip_blocks(fn, tool=GZIP_TOOL):
+    """Decompressed blocks of gzip file, decompression runs in pigz process (or given command)
+    or in background thread with zlib, in parallel with the consumer"""
+    if tool == "auto":
+        tool = shutil.which("pigz")
+    if tool:
+        proc = subprocess.Popen([tool, "-dc", fn], stdout=subprocess.PIPE)
+        try:
+            for block in iter(lambda: proc.stdout.read(GZIP_BLOCK), b""):
+                yield block
+            if proc.wait() != 0:
+                raise IOError("%s -dc %s failed with code %s" % (tool, fn, proc.returncode))
+        finally:
+            proc.stdout.close()
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+        return
+    blocks = queue.Queue(maxsize=GZIP_QUEUE)
+    stopped = threading.Event()
+    thread = threading.Thread(target=_decompress_gzip, args=(fn, blocks, stopped), daemon=True)
+    thread.start()
+    try:
+        while True:
+            block = blocks.get()
+            if block is None:
+                break
+            if isinstance(block, Exception):
+                raise block
+            yield block
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def gen_gzip_lines(fn, tool=GZIP_TOOL):
+    """Lines of gzip file as bytes without line ends"""
+    tail = b""
+    for block in gen_gzip_blocks(fn, tool):
+        lines = block.split(b"\n")
+        lines[0] = tail + lines[0]
+        tail = lines.pop()
+        yield from lines
+    if tail:
+        yield tail
+
+
 def insert_appsinstalled(memc, appsinstalled, dry_run=False):
     attempts = 5
     delay = 0.2
@@ -132,18 +229,17 @@ def process_handler(options):
 
     processed = errors = 0
     logging.info('Processing %s' % fn)
-    with gzip.open(fn, mode="rt") as fd:
-        for line in fd:
-            line = line.strip()
-            if not line:
-                continue
-            d_type = line.split()[0]
-            if d_type not in device_memc:
-                errors += 1
-                processed += 1
-                logging.error("Unknown device type: %s" % d_type)
-                continue
-            pool_queue[d_type].put(line)
+    for line in gen_gzip_lines(fn):
+        line = line.decode("utf-8").strip()
+        if not line:
+            continue
+        d_type = line.split()[0]
+        if d_type not in device_memc:
+            errors += 1
+            processed += 1
+            logging.error("Unknown device type: %s" % d_type)
+            continue
+        pool_queue[d_type].put(line)
 
     for d_type in device_memc:
         pool_queue[d_type].put(_sentinel)